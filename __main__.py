@@ -2,7 +2,14 @@
 
 """
 Usage:
-    init.py [<file>] [--pa=<pa-url>]
+    init.py [<file>] [--pa=<pa-url>...] [--record=<session>] [--player-view=<port>] [--log=<level>]
+
+Options:
+    --log=<level>           Logging level [default: WARNING]
+    --record=<session>      Record the session for replay with session.py
+    --player-view=<port>    Serve the read-only player view on this port
+
+Set BAZOOKA_PROFILE=1 to start with profiling enabled.
 """
 
 import flyingcarpet
@@ -10,34 +17,25 @@ from PyQt5 import QtCore, QtGui, QtWidgets
 import pathlib
 import datetime
 import json
+import logging
+import random
 import re
-import traceback
+import secrets
 import time
 
-from .planarally import PlanarAllyIntegration
-from .common import Creature, DEvalMode, DLexer, DParser, d_eval
-
-
-BASE_DIR = pathlib.Path("/home/matthew/D&D/Bazooka")
-SAVES_DIR = BASE_DIR / "Saves"
-SHEETS_DIR = BASE_DIR / "Sheets"
-CONDITIONS = [
-    "blinded",
-    "charmed",
-    "deafened",
-    *[f"exhaustion-{i}" for i in range(1, 6)],
-    "frightened",
-    "grappled",
-    "incapacitated",
-    "invisible",
-    "paralysed",
-    "petrified",
-    "poisoned",
-    "prone",
-    "restrained",
-    "stunned",
-    "unconscious"
-]
+from .planarally import PlanarAllyFeed, PlanarAllyIntegration
+from .playerview import PlayerView, PlayerViewServer
+from .changes import ChangeBus
+from .history import History, freeze, thaw
+from .filtering import FilterError, FilterIndex, creature_keys, parse_filter
+from .aoe import ABILITIES, apply_aoe, resolve_aoe, save_modifier
+from .common import Creature, CreatureGroup, DLexer, DParser, d_eval, groupable, new_creature_id, roll_hp, CONDITIONS, SAVES_DIR
+from .profiling import profiled, profiler
+from .qac import QACRunner, QACError
+from . import saveformat
+from .saveindex import SaveIndex, record_save
+from .session import SessionRecorder
+
 
 PA_INTEGRATION = [
     "pa",
@@ -68,14 +66,13 @@ COLOR_FOR_TAG.update({o: QtCore.Qt.darkYellow for o in OTHERS})
 
 TAG_COMPLETIONS = sorted(CONDITIONS + PA_INTEGRATION + OTHERS)
 
-LOADED_STAT_SHEETS = {}
+SAVE_FILTER = "Saves (*.json *.bzk);;Json Files (*.json);;Binary Files (*.bzk)"
 
 
-def load_stat_from_sheet(sheet, name):
-    if sheet not in LOADED_STAT_SHEETS:
-        with open(SHEETS_DIR / (sheet + ".json")) as f:
-            LOADED_STAT_SHEETS[sheet] = json.load(f)
-    return LOADED_STAT_SHEETS[sheet][name]
+def profiled_slot(name):
+    def decorator(f):
+        return QtCore.pyqtSlot()(profiled(name)(f))
+    return decorator
 
 
 class DValidator(QtGui.QValidator):
@@ -160,7 +157,7 @@ class CreatureDialog(QtWidgets.QDialog):
                 creature.xp = int(self.xp_edit.text()) if self.xp_edit.text() else None
             if (len(self.creatures) == 1 or self.max_hp_edit.text()) and creature.max_hp_generator != self.max_hp_edit.text():
                 creature.max_hp_generator = self.max_hp_edit.text()
-                creature.evaluated_max_hp = None
+                creature.evaluated_max_hp = creature.hp_error = None
         super().accept()
 
 
@@ -358,18 +355,157 @@ class TimeWarpDialog(QtWidgets.QDialog):
         super().accept()
 
 
+class AoEDialog(QtWidgets.QDialog):
+    def __init__(self, *args, title="Area Damage", creatures):
+        super().__init__(*args)
+
+        self.setWindowTitle(title)
+        self.creatures = creatures
+
+        self.setLayout(QtWidgets.QGridLayout())
+
+        self.damage_label = QtWidgets.QLabel("Damage:", self)
+        self.layout().addWidget(self.damage_label, 0, 0)
+
+        self.damage_edit = QtWidgets.QLineEdit(self)
+        self.damage_edit.setValidator(DValidator(self))
+        self.layout().addWidget(self.damage_edit, 0, 1)
+        self.damage_edit.textChanged.connect(self.set_ok_enabled)
+
+        self.type_label = QtWidgets.QLabel("Damage type:", self)
+        self.layout().addWidget(self.type_label, 1, 0)
+
+        self.type_edit = QtWidgets.QLineEdit(self)
+        self.type_edit.setPlaceholderText("e.g. fire, matches resist-fire, immune-fire and vulnerable-fire tags")
+        self.layout().addWidget(self.type_edit, 1, 1)
+
+        self.save_check = QtWidgets.QCheckBox("Saving throw:", self)
+        self.save_check.setChecked(True)
+        self.layout().addWidget(self.save_check, 2, 0)
+
+        self.save_layout = QtWidgets.QHBoxLayout()
+        self.layout().addLayout(self.save_layout, 2, 1)
+
+        self.ability_combo = QtWidgets.QComboBox(self)
+        self.ability_combo.addItems([a.upper() for a in ABILITIES])
+        self.ability_combo.setCurrentIndex(ABILITIES.index("dex"))
+        self.ability_combo.currentIndexChanged.connect(self.fill_modifiers)
+        self.save_layout.addWidget(self.ability_combo)
+
+        self.dc_spin = QtWidgets.QSpinBox(self)
+        self.dc_spin.setPrefix("DC ")
+        self.dc_spin.setRange(1, 40)
+        self.dc_spin.setValue(15)
+        self.save_layout.addWidget(self.dc_spin)
+
+        self.half_check = QtWidgets.QCheckBox("Half damage on success", self)
+        self.half_check.setChecked(True)
+        self.save_layout.addWidget(self.half_check)
+
+        self.modifier_table = QtWidgets.QTableWidget(len(creatures), 2, self)
+        self.modifier_table.setHorizontalHeaderLabels(["Creature", "Save modifier"])
+        self.modifier_table.horizontalHeader().setSectionResizeMode(0, QtWidgets.QHeaderView.Stretch)
+        self.modifier_table.verticalHeader().hide()
+        self.layout().addWidget(self.modifier_table, 3, 0, 1, 2)
+        for row, creature in enumerate(creatures):
+            self.modifier_table.setItem(row, 0, QtWidgets.QTableWidgetItem(creature.label))
+            self.modifier_table.item(row, 0).setFlags(QtCore.Qt.ItemIsEnabled)
+            self.modifier_table.setCellWidget(row, 1, QtWidgets.QSpinBox(self, minimum=-20, maximum=30))
+        self.fill_modifiers()
+
+        self.save_check.toggled.connect(self.ability_combo.setEnabled)
+        self.save_check.toggled.connect(self.dc_spin.setEnabled)
+        self.save_check.toggled.connect(self.half_check.setEnabled)
+        self.save_check.toggled.connect(self.modifier_table.setEnabled)
+
+        self.buttonbox = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel, self)
+        self.layout().addWidget(self.buttonbox, 100, 0, 1, 2)
+        self.buttonbox.accepted.connect(self.accept)
+        self.buttonbox.rejected.connect(self.reject)
+
+        self.resize(500, 500)
+        self.set_ok_enabled()
+
+    def fill_modifiers(self):
+        ability = ABILITIES[self.ability_combo.currentIndex()]
+        for row, creature in enumerate(self.creatures):
+            self.modifier_table.cellWidget(row, 1).setValue(save_modifier(creature, ability))
+
+    def set_ok_enabled(self):
+        if not self.damage_edit.hasAcceptableInput():
+            self.buttonbox.button(QtWidgets.QDialogButtonBox.Ok).setEnabled(False)
+        else:
+            self.buttonbox.button(QtWidgets.QDialogButtonBox.Ok).setEnabled(True)
+
+    def accept(self):
+        self.damage = self.damage_edit.text()
+        self.damage_type = self.type_edit.text().strip().lower() or None
+        self.dc = self.dc_spin.value() if self.save_check.isChecked() else None
+        self.half = self.half_check.isChecked()
+        self.modifiers = {creature.id: self.modifier_table.cellWidget(row, 1).value() for row, creature in enumerate(self.creatures)}
+        super().accept()
+
+
+class AoEResultsDialog(QtWidgets.QDialog):
+    def __init__(self, *args, title="Area Damage Results", damage, results):
+        super().__init__(*args)
+
+        self.setWindowTitle(title)
+
+        self.setLayout(QtWidgets.QGridLayout())
+
+        saved = sum(result.saved for result in results)
+        self.summary_label = QtWidgets.QLabel(f"Rolled {damage} damage, {saved}/{len(results)} saved", self)
+        self.layout().addWidget(self.summary_label, 0, 0)
+
+        self.results_table = QtWidgets.QTableWidget(len(results), 4, self)
+        self.results_table.setHorizontalHeaderLabels(["Target", "Save", "Damage", "HP"])
+        self.results_table.horizontalHeader().setSectionResizeMode(0, QtWidgets.QHeaderView.Stretch)
+        self.results_table.verticalHeader().hide()
+        self.results_table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.layout().addWidget(self.results_table, 1, 0)
+        for row, result in enumerate(results):
+            creature = result.creature
+            if result.member is None:
+                name, hp, max_hp = creature.name, creature.hp, creature.max_hp
+            else:
+                name, hp, max_hp = f"{creature.name} #{result.member + 1}", creature.member_hp(result.member), creature.member_max_hp[result.member]
+            save = "-" if result.roll is None else f"{result.roll}{result.modifier:+} = {result.roll + result.modifier} {'pass' if result.saved else 'fail'}"
+            for column, text in enumerate([name, save, str(result.damage), "?" if hp is None else f"{hp} / {max_hp}"]):
+                item = QtWidgets.QTableWidgetItem(text)
+                if column == 1 and result.roll is not None:
+                    item.setForeground(QtCore.Qt.darkGreen if result.saved else QtCore.Qt.red)
+                self.results_table.setItem(row, column, item)
+
+        self.buttonbox = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Close, self)
+        self.layout().addWidget(self.buttonbox, 100, 0)
+        self.buttonbox.rejected.connect(self.reject)
+
+        self.resize(500, 500)
+
+
 class QACDialog(QtWidgets.QDialog):
-    def __init__(self, *args, title="QAC", creature=None):
+    def __init__(self, *args, title="QAC", text="", error=None):
         super().__init__(*args)
 
         self.setWindowTitle(title)
 
         self.setLayout(QtWidgets.QGridLayout())
 
-        self.qac_edit = QtWidgets.QPlainTextEdit(self)
+        self.qac_edit = QtWidgets.QPlainTextEdit(text, self)
         self.qac_edit.textChanged.connect(self.set_ok_enabled)
         self.layout().addWidget(self.qac_edit, 0, 0)
 
+        if error is not None:
+            self.error_label = QtWidgets.QLabel(str(error), self)
+            self.error_label.setStyleSheet("QLabel { color: red; }")
+            self.layout().addWidget(self.error_label, 1, 0)
+
+            block = self.qac_edit.document().findBlockByLineNumber(error.line - 1)
+            cursor = QtGui.QTextCursor(block)
+            cursor.select(QtGui.QTextCursor.LineUnderCursor)
+            self.qac_edit.setTextCursor(cursor)
+
         self.buttonbox = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel, self)
         self.layout().addWidget(self.buttonbox, 100, 0, 1, 2)
         self.buttonbox.accepted.connect(self.accept)
@@ -388,6 +524,178 @@ class QACDialog(QtWidgets.QDialog):
         super().accept()
 
 
+class QACWorker(QtCore.QThread):
+    batch_ready = QtCore.pyqtSignal(list)
+    progress = QtCore.pyqtSignal(int)
+    failed = QtCore.pyqtSignal(object)
+
+    def __init__(self, runner, *args):
+        super().__init__(*args)
+        self.runner = runner
+
+    def run(self):
+        try:
+            with profiler.span("QACWorker.run", lines=self.runner.total_lines):
+                for line, batch in self.runner.run(cancelled=self.isInterruptionRequested):
+                    self.batch_ready.emit(batch)
+                    self.progress.emit(line)
+        except QACError as e:
+            self.failed.emit(e)
+
+
+class HPWorker(QtCore.QThread):
+    rolled = QtCore.pyqtSignal(object, int)
+
+    def __init__(self, pending, seed, serial, *args):
+        super().__init__(*args)
+        self.pending = pending
+        self.seed = seed
+        self.serial = serial
+
+    def run(self):
+        with profiler.span("HPWorker.run", creatures=len(self.pending)):
+            rng = random.Random(self.seed)
+            self.rolled.emit([
+                (creature, generator, [roll_hp(generator, rng) for _ in range(n)])
+                for creature, generator, n in self.pending
+            ], self.serial)
+
+
+class SyncStatsDialog(QtWidgets.QDialog):
+    def __init__(self, *args, title="PlanarAlly Sync Statistics", integrations):
+        super().__init__(*args)
+
+        self.setWindowTitle(title)
+        self.integrations = integrations
+
+        self.setLayout(QtWidgets.QGridLayout())
+
+        self.stats_edit = QtWidgets.QPlainTextEdit(self)
+        self.stats_edit.setReadOnly(True)
+        self.stats_edit.setFont(QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont))
+        self.layout().addWidget(self.stats_edit, 0, 0)
+
+        self.buttonbox = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Save | QtWidgets.QDialogButtonBox.Close, self)
+        self.layout().addWidget(self.buttonbox, 100, 0)
+        self.buttonbox.accepted.connect(self.export)
+        self.buttonbox.rejected.connect(self.reject)
+
+        self.refresh_timer = QtCore.QTimer(self)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.refresh_timer.start(1000)
+
+        self.resize(500, 600)
+        self.refresh()
+
+    def stats(self):
+        return {integration.name: integration.stats() for integration in self.integrations}
+
+    def refresh(self):
+        self.stats_edit.setPlainText(json.dumps(self.stats(), indent=4))
+
+    def export(self):
+        fname = QtWidgets.QFileDialog.getSaveFileName(self, "Export", "", "Json Files (*.json)")[0]
+        if fname:
+            with open(fname, "w") as f:
+                json.dump(self.stats(), f, indent=4)
+
+
+class SaveBrowserDialog(QtWidgets.QDialog):
+    COLUMNS = ["File", "Round", "XP", "Creatures", "Sides", "Started", "Saved"]
+
+    def __init__(self, *args, title="Browse Saves", index):
+        super().__init__(*args)
+
+        self.setWindowTitle(title)
+        self.index = index
+        self.fname = None
+
+        self.setLayout(QtWidgets.QGridLayout())
+
+        self.filter_edit = QtWidgets.QLineEdit(self)
+        self.filter_edit.setPlaceholderText("Filter by file name")
+        self.filter_edit.textChanged.connect(self.refresh)
+        self.layout().addWidget(self.filter_edit, 0, 0)
+
+        self.saves_table = QtWidgets.QTableWidget(0, len(self.COLUMNS), self)
+        self.saves_table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.saves_table.horizontalHeader().setSectionResizeMode(0, QtWidgets.QHeaderView.Stretch)
+        self.saves_table.verticalHeader().hide()
+        self.saves_table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.saves_table.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+        self.saves_table.setSelectionMode(QtWidgets.QAbstractItemView.SingleSelection)
+        self.saves_table.doubleClicked.connect(self.accept)
+        self.layout().addWidget(self.saves_table, 1, 0)
+
+        self.buttonbox = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Open | QtWidgets.QDialogButtonBox.Cancel, self)
+        self.layout().addWidget(self.buttonbox, 100, 0)
+        self.buttonbox.accepted.connect(self.accept)
+        self.buttonbox.rejected.connect(self.reject)
+
+        self.resize(900, 600)
+        self.refresh()
+
+    def refresh(self):
+        entries = self.index.entries(self.filter_edit.text())
+        self.saves_table.setSortingEnabled(False)
+        self.saves_table.setRowCount(len(entries))
+        for row, entry in enumerate(entries):
+            values = [
+                pathlib.Path(entry.fname).name,
+                entry.current_round,
+                entry.xp_gained,
+                entry.creatures,
+                ", ".join(f"{side}: {count}" for side, count in entry.sides.items()),
+                "" if entry.start_time is None else datetime.datetime.fromtimestamp(entry.start_time).strftime("%Y-%m-%d %H:%M"),
+                datetime.datetime.fromtimestamp(entry.mtime).strftime("%Y-%m-%d %H:%M")
+            ]
+            for column, value in enumerate(values):
+                item = QtWidgets.QTableWidgetItem()
+                item.setData(QtCore.Qt.DisplayRole, value)
+                if column == 0:
+                    item.setData(QtCore.Qt.UserRole, entry.fname)
+                self.saves_table.setItem(row, column, item)
+        self.saves_table.setSortingEnabled(True)
+
+    def accept(self):
+        row = self.saves_table.currentRow()
+        if row < 0:
+            return
+        self.fname = self.saves_table.item(row, 0).data(QtCore.Qt.UserRole)
+        super().accept()
+
+
+class ProfilerOverlay(QtWidgets.QLabel):
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.setAttribute(QtCore.Qt.WA_TransparentForMouseEvents)
+        self.setAutoFillBackground(True)
+        self.setFont(QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont))
+        self.setStyleSheet("background-color: rgba(0, 0, 0, 180); color: white; padding: 4px;")
+
+        self.refresh_timer = QtCore.QTimer(self)
+        self.refresh_timer.timeout.connect(self.refresh)
+
+    def showEvent(self, event):
+        self.refresh_timer.start(500)
+        self.refresh()
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.refresh_timer.stop()
+        super().hideEvent(event)
+
+    def refresh(self):
+        lines = [f"{'span':<36} {'n':>5} {'last':>8} {'mean':>8} {'max':>8}"]
+        for name, stats in list(profiler.summary().items())[:20]:
+            lines.append(f"{name[-36:]:<36} {stats['count']:>5} {stats['last_ms']:>8.2f} {stats['mean_ms']:>8.2f} {stats['max_ms']:>8.2f}")
+        if not profiler.enabled:
+            lines.append("(profiling disabled)")
+        self.setText("\n".join(lines))
+        self.adjustSize()
+        self.move(self.parentWidget().width() - self.width() - 20, 10)
+
+
 class CreatureListDelegate(QtWidgets.QStyledItemDelegate):
     NAME_WIDTH = 250
     HP_WIDTH = 75
@@ -401,6 +709,7 @@ class CreatureListDelegate(QtWidgets.QStyledItemDelegate):
     def sizeHint(self, option, index):
         return QtCore.QSize(option.rect.width(), 30)
 
+    @profiled("CreatureListDelegate.paint")
     def paint(self, painter, option, index):
         super().paint(painter, option, index)
         painter.setRenderHint(QtGui.QPainter.Antialiasing, True)
@@ -432,7 +741,7 @@ class CreatureListDelegate(QtWidgets.QStyledItemDelegate):
         painter.drawText(QtCore.QRectF(rect.topLeft() + QtCore.QPoint(along, 0),
                                        rect.bottomLeft() + QtCore.QPoint(self.NAME_WIDTH + along, 0)),
                          QtCore.Qt.AlignVCenter,
-                         metrics.elidedText(creature.name, QtCore.Qt.ElideMiddle, self.NAME_WIDTH))
+                         metrics.elidedText(creature.label, QtCore.Qt.ElideMiddle, self.NAME_WIDTH))
 
         along += self.NAME_WIDTH
         if creature.max_hp is not None:
@@ -459,6 +768,12 @@ class CreatureListDelegate(QtWidgets.QStyledItemDelegate):
                                            rect.bottomLeft() + QtCore.QPointF(self.HP_WIDTH + along, 0)),
                              QtCore.Qt.AlignVCenter,
                              metrics.elidedText(f" / {creature.max_hp}", QtCore.Qt.ElideRight, self.HP_WIDTH - first_width))
+        elif creature.hp_error:
+            painter.setPen(QtCore.Qt.red)
+            painter.drawText(QtCore.QRectF(rect.topLeft() + QtCore.QPointF(along, 0),
+                                           rect.bottomLeft() + QtCore.QPointF(self.HP_WIDTH + along, 0)),
+                             QtCore.Qt.AlignVCenter,
+                             metrics.elidedText(creature.hp_error, QtCore.Qt.ElideRight, self.HP_WIDTH))
         elif creature.damage_taken:
             painter.setPen(QtCore.Qt.darkRed)
             painter.drawText(QtCore.QRectF(rect.topLeft() + QtCore.QPointF(along, 0),
@@ -494,7 +809,7 @@ class CreatureListDelegate(QtWidgets.QStyledItemDelegate):
             else:
                 tags.append((f"{name}: {time_left}r", COLOR_FOR_TAG.get(name, QtCore.Qt.darkGray)))
         if creature.xp:
-            tags.append((f"XP: {creature.xp}", QtCore.Qt.darkBlue))
+            tags.append((f"XP: {creature.total_xp}", QtCore.Qt.darkBlue))
 
         if tags:
             tags.sort()
@@ -519,7 +834,77 @@ class CreatureListDelegate(QtWidgets.QStyledItemDelegate):
                 along += width + 6
 
 
+class GroupMembersView(QtWidgets.QListWidget):
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.group = None
+        self.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
+        self.setMaximumHeight(150)
+        self.hide()
+
+    def set_group(self, group):
+        if group is not self.group:
+            self.group = group
+            self.clear()
+        if group is None:
+            self.hide()
+            return
+        selected = self.selected_members()
+        self.clear()
+        for i in range(group.count):
+            hp = group.member_hp(i)
+            text = f"#{i + 1}  " + (f"{hp} / {group.member_max_hp[i]}" if hp is not None else f"HP - {group.member_damage[i]}")
+            tags = [name if rounds is None else f"{name}: {rounds}r" for name, rounds in group.member_tags[i]]
+            if tags:
+                text += "  " + ", ".join(tags)
+            item = QtWidgets.QListWidgetItem(text, self)
+            if hp == 0:
+                item.setForeground(QtCore.Qt.red)
+            item.setSelected(i in selected)
+        self.show()
+
+    def selected_members(self):
+        return sorted(self.row(item) for item in self.selectedItems())
+
+
 class CreatureListSortModel(QtCore.QSortFilterProxyModel):
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.layout_started = None
+        self.layoutAboutToBeChanged.connect(self.on_layout_about_to_be_changed)
+        self.layoutChanged.connect(self.on_layout_changed)
+        self.filter_index = FilterIndex()
+        self.refiltering = False
+
+    def setSourceModel(self, model):
+        super().setSourceModel(model)
+        model.rowsAboutToBeRemoved.connect(self.on_source_rows_about_to_be_removed)
+        model.modelAboutToBeReset.connect(self.filter_index.clear)
+
+    def on_source_rows_about_to_be_removed(self, parent, first, last):
+        for row in range(first, last + 1):
+            self.filter_index.remove(self.sourceModel().index(row, 0, parent).data(QtCore.Qt.UserRole).id)
+
+    def set_filter(self, text):
+        self.filter_index.set_terms(parse_filter(text))
+        self.refiltering = True
+        self.invalidateFilter()
+        self.refiltering = False
+
+    def filterAcceptsRow(self, row, parent):
+        creature = self.sourceModel().index(row, 0, parent).data(QtCore.Qt.UserRole)
+        if not self.refiltering or creature.id not in self.filter_index.keys:
+            self.filter_index.update(creature.id, creature_keys(creature))
+        return self.filter_index.accepts(creature.id)
+
+    def on_layout_about_to_be_changed(self):
+        self.layout_started = time.perf_counter()
+
+    def on_layout_changed(self):
+        if profiler.enabled and self.layout_started is not None:
+            profiler.record("CreatureListSortModel.sort", self.layout_started, time.perf_counter())
+        self.layout_started = None
+
     def lessThan(self, left, right):
         lcreature, rcreature = left.data(QtCore.Qt.UserRole), right.data(QtCore.Qt.UserRole)
         if rcreature.initiative is None:
@@ -532,6 +917,8 @@ class CreatureListSortModel(QtCore.QSortFilterProxyModel):
 
 
 class InitApp(flyingcarpet.App):
+    HP_WORKER_THRESHOLD = 64
+
     NAME = "Bazooka"
     LAUNCHER_NAME = "bazooka"
     GENERIC_NAME = "Initiative Tracker"
@@ -545,12 +932,23 @@ class InitApp(flyingcarpet.App):
     def __init__(self, creatures=[], fname=None):
         super().__init__(maximized=True, with_toolbar=True)
 
-        self.pa_integration = None
+        self.pa_feed = None
+        self.pa_integrations = []
+        self.recorder = None
+        self.player_view = None
+        self.synchronous = False
+        self.rng = random.Random()
+        self.creature_rows = {}
+        self.history = History()
 
         self.creature_list = QtWidgets.QListView(self)
         self.creature_model = QtGui.QStandardItemModel(self)
         self.creature_sort_model = CreatureListSortModel(self)
         self.creature_sort_model.setSourceModel(self.creature_model)
+        self.creature_model.rowsInserted.connect(self.on_creature_rows_inserted)
+        self.creature_model.rowsAboutToBeRemoved.connect(self.on_creature_rows_about_to_be_removed)
+        self.creature_model.modelReset.connect(self.creature_rows.clear)
+        self.changes = ChangeBus(self.creature_model, self.history)
         self.creature_sort_model.sort(0, QtCore.Qt.DescendingOrder)
         self.creature_list.setModel(self.creature_sort_model)
         self.creature_list.setItemDelegate(CreatureListDelegate(self))
@@ -560,8 +958,21 @@ class InitApp(flyingcarpet.App):
         self.creature_list.setAlternatingRowColors(True)
         self.creature_list.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
         self.creature_list.doubleClicked.connect(self.edit_selected_creatures)
+        self.filter_edit = QtWidgets.QLineEdit(self)
+        self.filter_edit.setPlaceholderText("Filter, e.g. side-2 tag:concentration hp<50% name~goblin initiative>15")
+        self.filter_edit.setClearButtonEnabled(True)
+        self.filter_edit.textChanged.connect(self.set_filter)
+        self.centralWidget().layout().addWidget(self.filter_edit)
         self.centralWidget().layout().addWidget(self.creature_list)
 
+        self.group_members = GroupMembersView(self)
+        self.centralWidget().layout().addWidget(self.group_members)
+        self.creature_list.selectionModel().selectionChanged.connect(self.update_group_members)
+        self.changes.subscribe(self.on_changeset)
+
+        self.filter_shortcut = QtWidgets.QShortcut(QtGui.QKeySequence.Find, self)
+        self.filter_shortcut.activated.connect(self.filter_edit.setFocus)
+
         self.add_creature_action = QtWidgets.QAction(QtGui.QIcon.fromTheme("list-add"), "Add Creature")
         self.add_creature_action.setShortcut(QtCore.Qt.Key_Insert)
         self.add_creature_action.triggered.connect(self.add_creature_dialog)
@@ -587,6 +998,11 @@ class InitApp(flyingcarpet.App):
         self.heal_creatures_action.triggered.connect(lambda: self.damage_selected_creatures(heal=True))
         self.toolBar.addAction(self.heal_creatures_action)
 
+        self.aoe_action = QtWidgets.QAction(QtGui.QIcon.fromTheme("crosshairs"), "Area Damage")
+        self.aoe_action.setShortcut(QtCore.Qt.CTRL | QtCore.Qt.SHIFT | QtCore.Qt.Key_D)
+        self.aoe_action.triggered.connect(self.aoe_selected_creatures)
+        self.toolBar.addAction(self.aoe_action)
+
         self.set_initiative_action = QtWidgets.QAction(QtGui.QIcon.fromTheme("clock"), "Set Initiative")
         self.set_initiative_action.setShortcut(QtCore.Qt.CTRL | QtCore.Qt.Key_I)
         self.set_initiative_action.triggered.connect(self.set_initiative_for_selected_creatures)
@@ -638,6 +1054,11 @@ class InitApp(flyingcarpet.App):
         self.save_action.triggered.connect(self.save)
         self.file_menu.addAction(self.save_action)
 
+        self.browse_saves_action = QtWidgets.QAction(QtGui.QIcon.fromTheme("folder-open"), "Browse Saves")
+        self.browse_saves_action.setShortcut(QtCore.Qt.CTRL | QtCore.Qt.Key_B)
+        self.browse_saves_action.triggered.connect(self.browse_saves)
+        self.file_menu.addAction(self.browse_saves_action)
+
         self.file_menu.addSeparator()
 
         self.load_creatures_action = QtWidgets.QAction(QtGui.QIcon.fromTheme("document-open"), "Load Creatures")
@@ -645,6 +1066,19 @@ class InitApp(flyingcarpet.App):
         self.load_creatures_action.triggered.connect(self.load_creatures)
         self.file_menu.addAction(self.load_creatures_action)
 
+        self.edit_menu = QtWidgets.QMenu("Edit", self.menuBar)
+        self.menuBar.addMenu(self.edit_menu)
+
+        self.undo_action = QtWidgets.QAction(QtGui.QIcon.fromTheme("edit-undo"), "Undo")
+        self.undo_action.setShortcut(QtGui.QKeySequence.Undo)
+        self.undo_action.triggered.connect(self.undo)
+        self.edit_menu.addAction(self.undo_action)
+
+        self.redo_action = QtWidgets.QAction(QtGui.QIcon.fromTheme("edit-redo"), "Redo")
+        self.redo_action.setShortcut(QtGui.QKeySequence.Redo)
+        self.redo_action.triggered.connect(self.redo)
+        self.edit_menu.addAction(self.redo_action)
+
         self.advanced_menu = QtWidgets.QMenu("Advanced", self.menuBar)
         self.menuBar.addMenu(self.advanced_menu)
 
@@ -653,6 +1087,16 @@ class InitApp(flyingcarpet.App):
         self.remove_creatures_noxp_action.triggered.connect(lambda: self.remove_selected_creatures(noxp=True))
         self.advanced_menu.addAction(self.remove_creatures_noxp_action)
 
+        self.group_creatures_action = QtWidgets.QAction("Group Creatures")
+        self.group_creatures_action.setShortcut(QtCore.Qt.CTRL | QtCore.Qt.Key_G)
+        self.group_creatures_action.triggered.connect(self.group_selected_creatures)
+        self.advanced_menu.addAction(self.group_creatures_action)
+
+        self.ungroup_creatures_action = QtWidgets.QAction("Ungroup Creatures")
+        self.ungroup_creatures_action.setShortcut(QtCore.Qt.CTRL | QtCore.Qt.SHIFT | QtCore.Qt.Key_G)
+        self.ungroup_creatures_action.triggered.connect(self.ungroup_selected_creatures)
+        self.advanced_menu.addAction(self.ungroup_creatures_action)
+
         self.advanced_menu.addSeparator()
 
         self.add_death_save_success_action = QtWidgets.QAction(QtGui.QIcon.fromTheme("emblem-success"), "Add Death Save Success")
@@ -697,18 +1141,55 @@ class InitApp(flyingcarpet.App):
         self.advanced_menu.addAction(self.auto_pa_tokens_action)
         self.auto_pa_tokens_action.setCheckable(True)
 
+        self.pa_stats_action = QtWidgets.QAction("PlanarAlly sync statistics")
+        self.pa_stats_action.triggered.connect(self.show_pa_stats)
+        self.advanced_menu.addAction(self.pa_stats_action)
+        self.pa_stats_action.setEnabled(False)
+
+        self.player_view_action = QtWidgets.QAction("Serve player view")
+        self.player_view_action.setCheckable(True)
+        self.player_view_action.toggled.connect(self.set_player_view)
+        self.advanced_menu.addAction(self.player_view_action)
+
+        self.advanced_menu.addSeparator()
+
+        self.profiling_action = QtWidgets.QAction("Enable profiling")
+        self.profiling_action.setCheckable(True)
+        self.profiling_action.setChecked(profiler.enabled)
+        self.profiling_action.toggled.connect(self.set_profiling)
+        self.advanced_menu.addAction(self.profiling_action)
+
+        self.profiler_overlay = ProfilerOverlay(self.creature_list)
+        self.profiler_overlay.hide()
+
+        self.profiler_overlay_action = QtWidgets.QAction("Show profiling overlay")
+        self.profiler_overlay_action.setCheckable(True)
+        self.profiler_overlay_action.toggled.connect(self.profiler_overlay.setVisible)
+        self.advanced_menu.addAction(self.profiler_overlay_action)
+
+        self.export_profile_action = QtWidgets.QAction("Export profiling trace")
+        self.export_profile_action.triggered.connect(self.export_profile)
+        self.advanced_menu.addAction(self.export_profile_action)
+
+        self.record_session_action = QtWidgets.QAction("Record session")
+        self.record_session_action.setCheckable(True)
+        self.record_session_action.toggled.connect(self.set_recording)
+        self.advanced_menu.addAction(self.record_session_action)
+
         self.ret_shortcut = QtWidgets.QShortcut(QtCore.Qt.Key_Return, self)
         self.ret_shortcut.activated.connect(self.edit_selected_creatures)
 
         for creature in creatures:
             self.add_creature(creature)
+        self._current_round = -1
+        self.start_time = time.time()
+        self.xp_gained = 0
         if fname is None:
             self.fname = str((SAVES_DIR / datetime.datetime.now().strftime("%H:%M %d-%m-%Y.json")).resolve())
-            self._current_round = -1
-            self.start_time = time.time()
-            self.xp_gained = 0
         else:
             self.load(fname=fname)
+        self.history.clear()
+        self.update_history_actions()
 
     @property
     def fname(self):
@@ -746,16 +1227,80 @@ class InitApp(flyingcarpet.App):
         return [self.creature_sort_model.mapToSource(self.creature_sort_model.index(row, 0)) for row in range(self.creature_sort_model.rowCount())]
 
     @property
-    def creatures_to_index(self):
-        return {idx.data(QtCore.Qt.UserRole): idx for idx in self.creature_indexes}
+    def source_creatures(self):
+        return [self.creature_model.item(row).data(QtCore.Qt.UserRole) for row in range(self.creature_model.rowCount())]
 
     @property
     def selected_creatures(self):
         return [idx.data(QtCore.Qt.UserRole) for idx in self.creature_list.selectedIndexes()]
 
     @property
-    def selected_creatures_to_index(self):
-        return {idx.data(QtCore.Qt.UserRole): idx for idx in self.creature_list.selectedIndexes()}
+    def selected_ids(self):
+        return [idx.data(QtCore.Qt.UserRole).id for idx in self.creature_list.selectedIndexes()]
+
+    def creature_index(self, creature):
+        return QtCore.QModelIndex(self.creature_rows[creature.id])
+
+    def items_for_ids(self, ids):
+        return [(item.data(QtCore.Qt.UserRole), item) for item in (self.creature_model.itemFromIndex(QtCore.QModelIndex(self.creature_rows[id])) for id in ids)]
+
+    def on_creature_rows_inserted(self, parent, first, last):
+        pending = []
+        for row in range(first, last + 1):
+            idx = self.creature_model.index(row, 0)
+            creature = idx.data(QtCore.Qt.UserRole)
+            if creature.id in self.creature_rows:
+                creature.id = new_creature_id()
+            self.creature_rows[creature.id] = QtCore.QPersistentModelIndex(idx)
+            if creature.hp_rolls_needed():
+                pending.append(creature)
+        if pending:
+            self.materialize_hp(pending)
+
+    def materialize_hp(self, creatures):
+        seed = self.rng.getrandbits(64)
+        if self.synchronous or len(creatures) < self.HP_WORKER_THRESHOLD:
+            rng = random.Random(seed)
+            for creature in creatures:
+                creature.materialize_hp(rng)
+            return
+        worker = HPWorker([(creature, creature.max_hp_generator, creature.hp_rolls_needed()) for creature in creatures], seed, self.history.serial, self)
+        worker.rolled.connect(self.on_hp_rolled)
+        worker.finished.connect(worker.deleteLater)
+        worker.start()
+
+    @profiled("InitApp.on_hp_rolled")
+    def on_hp_rolled(self, results, serial):
+        rolled = []
+        for creature, generator, rolls in results:
+            if creature.id in self.creature_rows and creature.max_hp_generator == generator and creature.hp_rolls_needed() == len(rolls):
+                creature.set_rolled_hp(rolls)
+                rolled.append(creature)
+        self.emit_creatures_changed(rolled)
+
+        pending = {creature.id: (generator, rolls) for creature, generator, rolls in results}
+
+        def patch(record):
+            data = thaw(record)
+            generator, rolls = pending.get(data["id"], (None, None))
+            if rolls is None:
+                return record
+            creature = Creature.from_json(data)
+            if creature.max_hp_generator != generator or creature.hp_rolls_needed() != len(rolls):
+                return record
+            creature.set_rolled_hp(rolls)
+            return freeze(creature)
+
+        self.history.amend(serial, patch)
+
+    def on_creature_rows_about_to_be_removed(self, parent, first, last):
+        for row in range(first, last + 1):
+            self.creature_rows.pop(self.creature_model.index(row, 0).data(QtCore.Qt.UserRole).id, None)
+
+    def on_changeset(self, changeset):
+        group = self.group_members.group
+        if group is not None and (group.id in changeset.changed or group.id in changeset.removed or changeset.reset):
+            self.update_group_members()
 
     def update_info_label(self):
         round = self.current_round if self.current_round > 0 else "Not yet started"
@@ -771,91 +1316,250 @@ class InitApp(flyingcarpet.App):
             "start_time": self.start_time
         }
 
+    @property
+    def encounter_state(self):
+        return self.current_round, self.xp_gained, self.start_time
+
+    def perform(self, action, seed=None, **args):
+        if seed is None:
+            seed = secrets.randbits(64)
+        if self.recorder is not None:
+            self.recorder.record(action, seed, args)
+        self.rng = random.Random(seed)
+        self.changes.begin(action, self.encounter_state)
+        try:
+            if action in ("undo", "redo"):
+                return getattr(self, f"do_{action}")(**args)
+            self.history.begin(action, self.encounter_state)
+            try:
+                return getattr(self, f"do_{action}")(**args)
+            finally:
+                self.history.commit(self.encounter_state)
+                self.update_history_actions()
+        finally:
+            self.changes.end(self.encounter_state)
+
+    def update_history_actions(self):
+        undo, redo = self.history.undo_stack, self.history.redo_stack
+        self.undo_action.setEnabled(bool(undo))
+        self.undo_action.setText(f"Undo {undo[-1].label.replace('_', ' ')}" if undo else "Undo")
+        self.redo_action.setEnabled(bool(redo))
+        self.redo_action.setText(f"Redo {redo[-1].label.replace('_', ' ')}" if redo else "Redo")
+
+    @profiled_slot("InitApp.undo")
+    def undo(self):
+        self.perform("undo")
+
+    @profiled_slot("InitApp.redo")
+    def redo(self):
+        self.perform("redo")
+
+    def do_undo(self):
+        entry = self.history.undo()
+        if entry is not None:
+            self.restore(entry, undo=True)
+
+    def do_redo(self):
+        entry = self.history.redo()
+        if entry is not None:
+            self.restore(entry, undo=False)
+
+    @profiled("InitApp.restore")
+    def restore(self, entry, undo):
+        self.history.suspended = True
+        try:
+            for kind, row, records in (reversed(entry.ops) if undo else entry.ops):
+                if (kind == "insert") == undo:
+                    self.creature_model.removeRows(row, len(records))
+                    continue
+                items = []
+                for record in records:
+                    item = QtGui.QStandardItem()
+                    item.setData(Creature.from_json(thaw(record)), QtCore.Qt.UserRole)
+                    items.append(item)
+                self.creature_model.invisibleRootItem().insertRows(row, items)
+            for id, (before, after) in entry.changes.items():
+                if id not in self.creature_rows:
+                    continue
+                item = self.creature_model.itemFromIndex(QtCore.QModelIndex(self.creature_rows[id]))
+                vars(item.data(QtCore.Qt.UserRole)).update(vars(Creature.from_json(thaw(before if undo else after))))
+                item.emitDataChanged()
+        finally:
+            self.history.suspended = False
+        self.current_round, self.xp_gained, self.start_time = entry.before if undo else entry.after
+        self.update_info_label()
+        self.update_history_actions()
+
+    @profiled_slot("InitApp.add_creature_dialog")
     def add_creature_dialog(self):
         creature = Creature()
         dia = CreatureDialog([creature])
         if dia.exec_():
-            self.add_creature(creature)
+            self.perform("add_creature", creature=creature.to_json())
+
+    def do_add_creature(self, creature):
+        self.add_creature(Creature.from_json(dict(creature)))
 
     def add_creature(self, creature):
         item = QtGui.QStandardItem()
         item.setData(creature, QtCore.Qt.UserRole)
         self.creature_model.appendRow(item)
 
+    @profiled("InitApp.add_creatures")
+    def add_creatures(self, creatures):
+        items = []
+        for creature in creatures:
+            item = QtGui.QStandardItem()
+            item.setData(creature, QtCore.Qt.UserRole)
+            items.append(item)
+        if items:
+            self.creature_model.invisibleRootItem().appendRows(items)
+
+    @profiled_slot("InitApp.clone_selected_creature")
     def clone_selected_creature(self):
-        for creature in self.selected_creatures:
-            self.add_creature(creature.clone())
+        self.perform("clone", ids=self.selected_ids)
+
+    def do_clone(self, ids):
+        self.add_creatures([creature.clone() for creature, _ in self.items_for_ids(ids)])
 
+    @profiled_slot("InitApp.remove_selected_creatures")
     def remove_selected_creatures(self, noxp=False):
-        for creature, idx in sorted(self.selected_creatures_to_index.items(), reverse=True, key=lambda x: x[1]):
-            self.creature_model.removeRow(self.creature_sort_model.mapToSource(idx).row())
-            if not noxp:
-                self.xp_gained += creature.xp or 0
+        self.perform("remove", ids=self.selected_ids, noxp=noxp)
+
+    def do_remove(self, ids, noxp):
+        rows = sorted(self.creature_rows[id].row() for id in ids)
+        if not noxp:
+            self.xp_gained += sum(self.creature_model.item(row).data(QtCore.Qt.UserRole).total_xp for row in rows)
+        ranges = []
+        for row in rows:
+            if ranges and ranges[-1][1] == row:
+                ranges[-1][1] += 1
+            else:
+                ranges.append([row, row + 1])
+        for first, end in reversed(ranges):
+            self.creature_model.removeRows(first, end - first)
 
+    def do_remove_rows(self, first, count):
+        self.creature_model.removeRows(first, count)
+
+    @profiled_slot("InitApp.damage_selected_creatures")
     def damage_selected_creatures(self, heal=False):
-        scti = self.selected_creatures_to_index
-        if not scti:
+        ids = self.selected_ids
+        if not ids:
             return
 
         dia = DamageDialog(self, heal=heal)
         if dia.exec_():
             print("Damage =>", dia.damage)
-            for creature, idx in scti.items():
-                creature.apply_damage(dia.damage)
-                self.creature_model.itemFromIndex(self.creature_sort_model.mapToSource(idx)).emitDataChanged()
+            self.perform("damage", ids=ids, damage=dia.damage, members=self.selected_members())
+
+    def do_damage(self, ids, damage, members=None):
+        for creature, item in self.items_for_ids(ids):
+            if members is not None:
+                creature.apply_member_damage(members, damage)
+            else:
+                creature.apply_damage(damage)
+            item.emitDataChanged()
 
+    @profiled_slot("InitApp.aoe_selected_creatures")
+    def aoe_selected_creatures(self):
+        ids = self.selected_ids
+        if not ids:
+            return
+
+        dia = AoEDialog(self, creatures=[creature for creature, _ in self.items_for_ids(ids)])
+        if not dia.exec_():
+            return
+
+        damage, results = self.perform("aoe", ids=ids, damage=dia.damage, damage_type=dia.damage_type, dc=dia.dc, half=dia.half, modifiers=dia.modifiers)
+        AoEResultsDialog(self, damage=damage, results=results).exec_()
+
+    def do_aoe(self, ids, damage, damage_type, dc, half, modifiers):
+        creatures = [creature for creature, _ in self.items_for_ids(ids)]
+        damage = d_eval(damage, rng=self.rng)
+        results = resolve_aoe(creatures, damage, dc, modifiers, damage_type=damage_type, half=half, rng=self.rng)
+        apply_aoe(results)
+        self.emit_creatures_changed(creatures)
+        return damage, results
+
+    def emit_creatures_changed(self, creatures):
+        rows = sorted(self.creature_rows[creature.id].row() for creature in creatures)
+        ranges = []
+        for row in rows:
+            if ranges and ranges[-1][1] == row:
+                ranges[-1][1] += 1
+            else:
+                ranges.append([row, row + 1])
+        for first, end in ranges:
+            self.creature_model.dataChanged.emit(self.creature_model.index(first, 0), self.creature_model.index(end - 1, 0))
+
+    @profiled_slot("InitApp.set_initiative_for_selected_creatures")
     def set_initiative_for_selected_creatures(self):
-        scti = self.selected_creatures_to_index
-        if not scti:
+        ids = self.selected_ids
+        if not ids:
             return
 
         dia = InitiativeDialog(self)
         if dia.exec_():
             print("Initiative =>", dia.initiative)
-            idxes = []
-            for creature, idx in [(c, self.creature_model.itemFromIndex(self.creature_sort_model.mapToSource(i))) for c, i in scti.items()]:
-                creature.initiative = dia.initiative
-                idx.emitDataChanged()
+            self.perform("initiative", ids=ids, initiative=dia.initiative)
+
+    def do_initiative(self, ids, initiative):
+        for creature, item in self.items_for_ids(ids):
+            creature.initiative = initiative
+            item.emitDataChanged()
 
+    @profiled_slot("InitApp.edit_selected_creatures")
     def edit_selected_creatures(self):
-        idxs = self.creature_list.selectedIndexes()
-        if idxs:
-            dia = CreatureDialog(self, creatures=[idx.data(QtCore.Qt.UserRole) for idx in idxs])
+        ids = self.selected_ids
+        if ids:
+            creatures = [creature for creature, _ in self.items_for_ids(ids)]
+            dia = CreatureDialog(self, creatures=creatures)
             if dia.exec_():
-                for idx in idxs:
-                    self.creature_model.itemFromIndex(self.creature_sort_model.mapToSource(idx)).emitDataChanged()
+                self.perform("edit", ids=ids, creatures=[creature.to_json() for creature in creatures])
+
+    def do_edit(self, ids, creatures):
+        for (creature, item), data in zip(self.items_for_ids(ids), creatures):
+            if data is not creature.__dict__:
+                creature.__dict__.update(Creature.from_json(dict(data)).__dict__)
+            creature.materialize_hp(self.rng)
+            item.emitDataChanged()
 
     def current_creature(self, creatures=None):
         if self.current_round < 1:
             return None
-        creatures = self.creatures if creatures is None else creatures
+        creatures = self.source_creatures if creatures is None else creatures
         creatures_in_initiative = [c for c in creatures if c.initiative is not None]
         if not creatures_in_initiative:
             return None
         creatures_that_have_yet_to_go = [c for c in creatures_in_initiative if c.completed_round < self.current_round]
         return max(creatures_that_have_yet_to_go, key=lambda c: c.initiative) if creatures_that_have_yet_to_go else None
 
+    @profiled_slot("InitApp.next_turn")
     def next_turn(self):
-        creatures = self.creatures_to_index
+        self.perform("next_turn")
+
+    def do_next_turn(self):
+        creatures = self.source_creatures
         if self.current_round > 0:
-            current = self.current_creature(creatures.keys())
+            current = self.current_creature(creatures)
             if not current:
                 return
             current.end_turn()
             current.completed_round = self.current_round
-            self.creature_model.itemFromIndex(creatures[current]).emitDataChanged()
+            self.creature_model.itemFromIndex(self.creature_index(current)).emitDataChanged()
         else:
             if not any(c.initiative is not None for c in creatures):
                 return
             self.current_round = 1
 
-        current = self.current_creature(creatures.keys())
+        current = self.current_creature(creatures)
         if not current:
             self.current_round += 1
-            current = self.current_creature(creatures.keys())
+            current = self.current_creature(creatures)
         current.start_turn()
-        self.creature_model.itemFromIndex(creatures[current]).emitDataChanged()
-        self.select_indexes([self.creature_sort_model.mapFromSource(creatures[current])])
+        self.creature_model.itemFromIndex(self.creature_index(current)).emitDataChanged()
+        self.select_indexes([self.creature_sort_model.mapFromSource(self.creature_index(current))])
 
     def select_indexes(self, idxs, clear=True):
         selection = QtCore.QItemSelection()
@@ -863,26 +1567,39 @@ class InitApp(flyingcarpet.App):
             selection.select(index, index)
         self.creature_list.selectionModel().select(selection, QtCore.QItemSelectionModel.Select | QtCore.QItemSelectionModel.Rows | (QtCore.QItemSelectionModel.Clear & clear))
 
+    @profiled_slot("InitApp.add_tag_to_selected_creatures")
     def add_tag_to_selected_creatures(self):
-        scti = self.selected_creatures_to_index
-        if not scti:
+        ids = self.selected_ids
+        if not ids:
             return
 
         dia = TagDialog(self)
         if not dia.exec_():
             return
 
-        for creature, idx in scti.items():
-            if dia.tag not in creature.tags:
-                creature.tags.append(dia.tag)
-            self.creature_model.itemFromIndex(self.creature_sort_model.mapToSource(idx)).emitDataChanged()
+        self.perform("add_tag", ids=ids, tag=dia.tag, members=self.selected_members())
+
+    def do_add_tag(self, ids, tag, members=None):
+        tag = tuple(tag)
+        for creature, item in self.items_for_ids(ids):
+            if members is not None:
+                creature.add_member_tag(members, tag)
+            elif tag not in creature.tags:
+                creature.tags.append(tag)
+            item.emitDataChanged()
 
+    @profiled_slot("InitApp.remove_tags_from_selected_creatures")
     def remove_tags_from_selected_creatures(self):
-        scti = self.selected_creatures_to_index
-        if not scti:
+        ids = self.selected_ids
+        if not ids:
             return
 
-        tags = set.union(*[set(c.tags) for c in scti])
+        members = self.selected_members()
+        if members is not None:
+            group = self.group_members.group
+            tags = set().union(*[group.member_tags[i] for i in members])
+        else:
+            tags = set.union(*[set(c.tags) for c, _ in self.items_for_ids(ids)])
         if not tags:
             return
 
@@ -890,138 +1607,230 @@ class InitApp(flyingcarpet.App):
         if not dia.exec_():
             return
 
-        for creature, idx in scti.items():
-            creature.tags = [t for t in creature.tags if t not in dia.tags]
-            self.creature_model.itemFromIndex(self.creature_sort_model.mapToSource(idx)).emitDataChanged()
+        self.perform("remove_tags", ids=ids, tags=dia.tags, members=members)
 
+    def do_remove_tags(self, ids, tags, members=None):
+        tags = [tuple(t) for t in tags]
+        for creature, item in self.items_for_ids(ids):
+            if members is not None:
+                creature.remove_member_tags(members, tags)
+            else:
+                creature.tags = [t for t in creature.tags if t not in tags]
+            item.emitDataChanged()
+
+    def selected_members(self):
+        if self.group_members.isHidden():
+            return None
+        return self.group_members.selected_members() or None
+
+    def update_group_members(self):
+        creatures = self.selected_creatures
+        self.group_members.set_group(creatures[0] if len(creatures) == 1 and isinstance(creatures[0], CreatureGroup) else None)
+
+    @profiled_slot("InitApp.group_selected_creatures")
+    def group_selected_creatures(self):
+        ids = self.selected_ids
+        if len(ids) < 2:
+            return
+        if not groupable(self.group_candidates(ids)):
+            QtWidgets.QMessageBox.warning(self, "Group Creatures", "Only creatures with the same name, HP, XP, initiative and saves can be grouped", QtWidgets.QMessageBox.Ok)
+            return
+        self.perform("group", ids=ids)
+
+    def group_candidates(self, ids):
+        rows = sorted((self.creature_rows[id].row(), id) for id in ids)
+        members = []
+        for creature, _ in self.items_for_ids([id for _, id in rows]):
+            members.extend(creature.members() if isinstance(creature, CreatureGroup) else [creature])
+        return members
+
+    def do_group(self, ids):
+        group = CreatureGroup.from_creatures(self.group_candidates(ids))
+        self.do_remove(ids, noxp=True)
+        self.add_creature(group)
+
+    @profiled_slot("InitApp.ungroup_selected_creatures")
+    def ungroup_selected_creatures(self):
+        ids = [creature.id for creature in self.selected_creatures if isinstance(creature, CreatureGroup)]
+        if ids:
+            self.perform("ungroup", ids=ids)
+
+    def do_ungroup(self, ids):
+        members = []
+        for creature, _ in self.items_for_ids(ids):
+            members.extend(creature.members())
+        self.do_remove(ids, noxp=True)
+        self.add_creatures(members)
+
+    @profiled_slot("InitApp.add_death_save_to_selected_creatures")
     def add_death_save_to_selected_creatures(self, success=True):
-        for creature, idx in self.selected_creatures_to_index.items():
+        self.perform("death_save", ids=self.selected_ids, success=success)
+
+    def do_death_save(self, ids, success):
+        for creature, item in self.items_for_ids(ids):
             if success:
                 creature.death_saves_success = min(3, creature.death_saves_success + 1)
             else:
                 creature.death_saves_failure = min(3, creature.death_saves_failure + 1)
-            self.creature_model.itemFromIndex(self.creature_sort_model.mapToSource(idx)).emitDataChanged()
+            item.emitDataChanged()
 
+    @profiled_slot("InitApp.clear_death_saves_from_selected_creatures")
     def clear_death_saves_from_selected_creatures(self):
-        for creature, idx in self.selected_creatures_to_index.items():
+        self.perform("clear_death_saves", ids=self.selected_ids)
+
+    def do_clear_death_saves(self, ids):
+        for creature, item in self.items_for_ids(ids):
             creature.death_saves_success = creature.death_saves_failure = 0
-            self.creature_model.itemFromIndex(self.creature_sort_model.mapToSource(idx)).emitDataChanged()
+            item.emitDataChanged()
 
+    @profiled_slot("InitApp.time_warp")
     def time_warp(self):
         dia = TimeWarpDialog(self)
         if not dia.exec_():
             return
 
-        cl = len([c for c in self.creatures if c.initiative is not None])
+        self.perform("time_warp", rounds=dia.time)
+
+    def do_time_warp(self, rounds):
+        cl = len([c for c in self.source_creatures if c.initiative is not None])
 
-        for _ in range(dia.time):
+        for _ in range(rounds):
             for _ in range(cl):
-                self.next_turn()
+                self.do_next_turn()
 
+    @profiled_slot("InitApp.reset_start_time")
     def reset_start_time(self):
+        self.perform("reset_start_time")
+
+    def do_reset_start_time(self):
         self.start_time = time.time()
         self.update_info_label()
 
+    @profiled_slot("InitApp.load")
     def load(self, *, fname=None):
         if fname is None:
-            fname = QtWidgets.QFileDialog.getOpenFileName(self, "Open", str(pathlib.Path(self.fname).parent), "Json Files (*.json)")[0]
+            fname = QtWidgets.QFileDialog.getOpenFileName(self, "Open", str(pathlib.Path(self.fname).parent), SAVE_FILTER)[0]
             if not fname:
                 return
 
-        self.fname = fname
-        with open(fname) as f:
-            data = json.load(f)
+        self.perform("load", fname=fname, data=saveformat.read(fname))
 
+    def do_load(self, fname, data):
+        self.fname = fname
         self.creature_model.clear()
-        for creature in data["creatures"]:
-            self.add_creature(Creature.from_json(creature))
+        self.add_creatures([Creature.from_json(dict(creature)) for creature in data["creatures"]])
         self.current_round = data.get("current_round", 1)
         self.xp_gained = data.get("xp_gained", 0)
         self.start_time = data.get("start_time", time.time())
         self.update_info_label()
 
+    @profiled_slot("InitApp.browse_saves")
+    def browse_saves(self):
+        index = SaveIndex(pathlib.Path(self.fname).parent)
+        try:
+            index.refresh()
+            dia = SaveBrowserDialog(self, index=index)
+            if dia.exec_() and dia.fname:
+                self.load(fname=dia.fname)
+        finally:
+            index.close()
+
+    @profiled_slot("InitApp.load_creatures")
     def load_creatures(self):
-        fname = QtWidgets.QFileDialog.getOpenFileName(self, "Open", str(pathlib.Path(self.fname).parent), "Json Files (*.json)")[0]
+        fname = QtWidgets.QFileDialog.getOpenFileName(self, "Open", str(pathlib.Path(self.fname).parent), SAVE_FILTER)[0]
         if not fname:
             return
 
-        with open(fname) as f:
-            data = json.load(f)
+        self.perform("load_creatures", creatures=list(saveformat.read(fname)["creatures"]))
 
-        for creature in data["creatures"]:
-            creature = Creature.from_json(creature)
+    def do_load_creatures(self, creatures):
+        loaded = []
+        for creature in creatures:
+            creature = Creature.from_json(dict(creature))
             creature.evaluated_max_hp = creature.initiative = None
             creature.damage_taken = creature.death_saves_success = creature.death_saves_failure = 0
             creature.completed_round = -1
-            self.add_creature(creature)
+            creature.pa_tokens = {}
+            creature.id = new_creature_id()
+            loaded.append(creature)
+        self.add_creatures(loaded)
 
+    @profiled_slot("InitApp.save")
     def save(self):
-        fname = QtWidgets.QFileDialog.getSaveFileName(self, "Save", self.fname, "Json Files (*.json)")
+        fname = QtWidgets.QFileDialog.getSaveFileName(self, "Save", self.fname, SAVE_FILTER)
         if fname[0]:
-            self.fname = fname[0]
-            with open(fname[0], "w") as f:
-                json.dump(self.to_json(), f, indent=4)
+            self.perform("save", fname=fname[0])
 
-    def quikaddcode(self):
-        dia = QACDialog(self)
+    def do_save(self, fname):
+        self.fname = fname
+        data = self.to_json()
+        saveformat.write(fname, data)
+        record_save(fname, data)
+
+    @profiled_slot("InitApp.quikaddcode")
+    def quikaddcode(self, *, text="", error=None):
+        dia = QACDialog(self, text=text, error=error)
         if not dia.exec_():
             return
-        code = [x.strip() for x in re.split("[;\n]", dia.qac) if x.strip()]
-        code = [(x[0], x[1:].strip()) for x in code]
-        creatures = []
-        hp_de_mode = DEvalMode.normal
-        try:
-            for op, arg in code:
-                if op == "a":
-                    creatures.append(Creature(name=arg))
-                elif op == "h":
-                    val = d_eval(arg, mode=hp_de_mode)
-                    if hp_de_mode is DEvalMode.normal:
-                        creatures[-1].max_hp_generator = arg
-                    else:
-                        creatures[-1].max_hp_generator = str(val)
-                elif op == "i":
-                    creatures[-1].initiative = d_eval(arg)
-                elif op == "x":
-                    creatures[-1].xp = int(arg)
-                elif op == "c":
-                    for _ in range(int(arg)):
-                        creatures.append(creatures[-1].clone())
-                elif op == "t":
-                    if ":" in arg:
-                        tag, rounds = arg.split(":", 1)
-                        rounds = int(rounds)
-                    else:
-                        tag, rounds = arg, None
-                    creatures[-1].tags.append((tag, rounds))
-                elif op == "s":
-                    sheet, name = arg.split(":", 1)
-                    data = load_stat_from_sheet(sheet, name)
-                    tags = []
-                    for tag in data.get("tags", []):
-                        if ":" in tag:
-                            tag, rounds = tag.split(":", 1)
-                            rounds = int(rounds)
-                        else:
-                            tag, rounds = tag, None
-                        tags.append((tag, rounds))
-                    init = d_eval(data.get("init"))
-                    hp = data["hp"] if hp_de_mode is DEvalMode.normal else str(d_eval(data["hp"], mode=hp_de_mode))
-                    creatures.append(Creature(name=name, max_hp_generator=hp, xp=data.get("xp"), initiative=init, tags=tags))
-                elif op == "e":
-                    if arg == "hn":
-                        hp_de_mode = DEvalMode.normal
-                    elif arg == "ha":
-                        hp_de_mode = DEvalMode.average
-
-        except Exception:
-            QtWidgets.QMessageBox.warning(self, "QAC Failed", "".join(traceback.format_exc()), QtWidgets.QMessageBox.Ok)
-        else:
-            for creature in creatures:
-                if not creature.max_hp_generator:
-                    creature.max_hp_generator = "1"
-                self.add_creature(creature)
 
+        self.perform("quikaddcode", text=dia.qac)
+
+    def do_quikaddcode(self, text):
+        runner = QACRunner(text, rng=random.Random(self.rng.getrandbits(64)))
+
+        if self.synchronous:
+            try:
+                batches = [batch for _, batch in runner.run()]
+            except QACError:
+                return
+            for batch in batches:
+                self.add_creatures(batch)
+            return
+
+        worker = QACWorker(runner, self)
+        progress = QtWidgets.QProgressDialog("Running QAC...", "Cancel", 0, runner.total_lines, self)
+        progress.setWindowModality(QtCore.Qt.WindowModal)
+        progress.setMinimumDuration(500)
+
+        inserted = []
+
+        def add_batch(batch):
+            inserted.extend(batch)
+            self.add_creatures(batch)
+
+        def end_history(keep):
+            if not worker.in_history:
+                return
+            worker.in_history = False
+            if keep:
+                self.history.commit(self.encounter_state)
+            else:
+                self.do_remove([creature.id for creature in inserted if creature.id in self.creature_rows], noxp=True)
+                self.history.rollback()
+            self.update_history_actions()
+            self.changes.end(self.encounter_state)
+
+        def failed(e):
+            end_history(keep=False)
+            progress.reset()
+            self.quikaddcode(text=text, error=e)
+
+        def finished():
+            end_history(keep=not worker.isInterruptionRequested())
+            progress.reset()
+            worker.deleteLater()
+
+        worker.batch_ready.connect(add_batch)
+        worker.progress.connect(progress.setValue)
+        worker.failed.connect(failed)
+        worker.finished.connect(finished)
+        progress.canceled.connect(worker.requestInterruption)
+        self.changes.begin("quikaddcode", self.encounter_state)
+        self.history.begin("quikaddcode", self.encounter_state)
+        worker.in_history = True
+        worker.start()
+
+    @profiled_slot("InitApp.start_pa_integration")
     def start_pa_integration(self):
         url, _ = QtWidgets.QInputDialog.getText(self, "PlanarAlly Integration", "URL")
         if url:
@@ -1031,23 +1840,115 @@ class InitApp(flyingcarpet.App):
 
     def start_pa_integration_with_values(self, url, password):
         url, username, room = re.match("(.*)/game/(\w+)/(.+)$", url).groups()
-        self.pa_integration = PlanarAllyIntegration(url, username, password, room, self.creature_model)
-        self.start_pa_integration_action.setEnabled(False)
+        if self.pa_feed is None:
+            self.pa_feed = PlanarAllyFeed(self.creature_model, self.changes)
+        integration = PlanarAllyIntegration(url, username, password, room, self.pa_feed)
+        integration.transport.failed.connect(lambda message: self.pa_integration_failed(integration, message))
+        integration.set_auto_add(self.auto_pa_tokens_action.isChecked())
+        self.pa_integrations.append(integration)
         self.stop_pa_integration_action.setEnabled(True)
-        self.pa_integration.set_auto_add(self.auto_pa_tokens_action.isChecked())
+        self.pa_stats_action.setEnabled(True)
 
+    @profiled_slot("InitApp.stop_pa_integration")
     def stop_pa_integration(self):
-        self.pa_integration.close()
-        self.pa_integration = None
-        self.start_pa_integration_action.setEnabled(True)
-        self.stop_pa_integration_action.setEnabled(False)
+        if len(self.pa_integrations) > 1:
+            names = [integration.name for integration in self.pa_integrations]
+            name, ok = QtWidgets.QInputDialog.getItem(self, "PlanarAlly Integration", "Stop", ["All"] + names, 0, False)
+            if not ok:
+                return
+            if name != "All":
+                self.stop_pa_integrations([self.pa_integrations[names.index(name)]])
+                return
+        self.stop_pa_integrations(list(self.pa_integrations))
+
+    def stop_pa_integrations(self, integrations):
+        for integration in integrations:
+            integration.close()
+            self.pa_integrations.remove(integration)
+        self.stop_pa_integration_action.setEnabled(bool(self.pa_integrations))
+        self.pa_stats_action.setEnabled(bool(self.pa_integrations))
+
+    def pa_integration_failed(self, integration, message):
+        if integration not in self.pa_integrations:
+            return
+        self.stop_pa_integrations([integration])
+        QtWidgets.QMessageBox.warning(self, "PlanarAlly Integration", f"Could not connect to PlanarAlly: {message}", QtWidgets.QMessageBox.Ok)
+
+    @profiled_slot("InitApp.show_pa_stats")
+    def show_pa_stats(self):
+        if self.pa_integrations:
+            SyncStatsDialog(self, integrations=self.pa_integrations).exec_()
 
     def set_pa_integration_auto_add(self, value):
-        self.pa_integration.set_auto_add(bool(value))
+        for integration in self.pa_integrations:
+            integration.set_auto_add(bool(value))
+
+    @profiled("InitApp.set_filter")
+    def set_filter(self, text):
+        try:
+            self.creature_sort_model.set_filter(text)
+        except FilterError as e:
+            self.filter_edit.setStyleSheet("QLineEdit { color: darkred; }")
+            self.filter_edit.setToolTip(str(e))
+        else:
+            self.filter_edit.setStyleSheet("")
+            self.filter_edit.setToolTip("")
+
+    def set_profiling(self, value):
+        profiler.enabled = bool(value)
+
+    def export_profile(self):
+        fname = QtWidgets.QFileDialog.getSaveFileName(self, "Export", "", "Chrome Trace Files (*.json)")[0]
+        if fname:
+            profiler.export(fname)
+
+    def set_recording(self, value):
+        if value and self.recorder is None:
+            fname = QtWidgets.QFileDialog.getSaveFileName(self, "Record session", "", "Session Files (*.jsonl)")[0]
+            if not fname:
+                self.record_session_action.setChecked(False)
+                return
+            self.start_recording(fname)
+        elif not value and self.recorder is not None:
+            self.changes.unsubscribe(self.recorder.on_changeset)
+            self.recorder.close()
+            self.recorder = None
+
+    def start_recording(self, fname):
+        self.recorder = SessionRecorder(fname)
+        self.changes.subscribe(self.recorder.on_changeset)
+        self.recorder.snapshot(self.to_json() | {"creatures": [creature.to_json() for creature in self.source_creatures]})
+        self.record_session_action.setChecked(True)
+
+    def set_player_view(self, value):
+        if value and self.player_view is None:
+            port, ok = QtWidgets.QInputDialog.getInt(self, "Player View", "Port", 8765, 0, 65535)
+            if not ok:
+                self.player_view_action.setChecked(False)
+                return
+            self.start_player_view(port)
+        elif not value and self.player_view is not None:
+            self.stop_player_view()
+
+    def start_player_view(self, port):
+        server = PlayerViewServer(port=port)
+        server.start()
+        self.player_view = PlayerView(self, server)
+        self.player_view_action.setChecked(True)
+        self.player_view_action.setText(f"Serve player view (port {server.port})")
+
+    def stop_player_view(self):
+        self.player_view.close()
+        self.player_view.server.stop()
+        self.player_view = None
+        self.player_view_action.setText("Serve player view")
 
     def closeEvent(self, event):
-        if self.pa_integration:
-            self.stop_pa_integration()
+        self.stop_pa_integrations(list(self.pa_integrations))
+        if self.player_view is not None:
+            self.stop_player_view()
+        if self.recorder is not None:
+            self.recorder.close()
 
         super().closeEvent(event)
 
@@ -1057,10 +1958,17 @@ if __name__ == "__main__":
     import json
 
     args = docopt.docopt(__doc__)
+    logging.basicConfig(level=args["--log"].upper(), format="%(asctime)s %(name)s %(levelname)s: %(message)s")
 
     app = InitApp(fname=args["<file>"])
 
-    if args["--pa"]:
-        app.start_pa_integration_with_values(*args["--pa"].rsplit(":", 1))
+    if args["--record"]:
+        app.start_recording(args["--record"])
+
+    for pa in args["--pa"]:
+        app.start_pa_integration_with_values(*pa.rsplit(":", 1))
+
+    if args["--player-view"]:
+        app.start_player_view(int(args["--player-view"]))
 
     app.run()
@@ -0,0 +1,57 @@
+import collections
+import random
+
+from .common import CreatureGroup
+
+
+ABILITIES = ["str", "dex", "con", "int", "wis", "cha"]
+
+AoEResult = collections.namedtuple("AoEResult", "creature member roll modifier saved damage")
+
+
+def damage_multiplier(tags, damage_type):
+    if not damage_type:
+        return 1
+    tags = {t for t, _ in tags}
+    if f"immune-{damage_type}" in tags:
+        return 0
+    multiplier = 1
+    if f"resist-{damage_type}" in tags:
+        multiplier /= 2
+    if f"vulnerable-{damage_type}" in tags:
+        multiplier *= 2
+    return multiplier
+
+
+def save_modifier(creature, ability):
+    return creature.saves.get(ability, 0)
+
+
+def aoe_targets(creatures):
+    targets = []
+    for creature in creatures:
+        if isinstance(creature, CreatureGroup):
+            targets.extend((creature, i, creature.tags + creature.member_tags[i]) for i in range(creature.count))
+        else:
+            targets.append((creature, None, creature.tags))
+    return targets
+
+
+def resolve_aoe(creatures, damage, dc, modifiers, damage_type=None, half=True, rng=random):
+    targets = aoe_targets(creatures)
+    rolls = [rng.randint(1, 20) for _ in targets] if dc is not None else [None] * len(targets)
+    results = []
+    for (creature, member, tags), roll in zip(targets, rolls):
+        modifier = modifiers.get(creature.id, 0)
+        saved = roll is not None and roll + modifier >= dc
+        dealt = (damage // 2 if half else 0) if saved else damage
+        results.append(AoEResult(creature, member, roll, modifier, saved, int(dealt * damage_multiplier(tags, damage_type))))
+    return results
+
+
+def apply_aoe(results):
+    for result in results:
+        if result.member is None:
+            result.creature.apply_damage(result.damage)
+        else:
+            result.creature.apply_member_damage([result.member], result.damage)
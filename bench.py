@@ -0,0 +1,186 @@
+"""
+Usage:
+    bench.py [--sizes=<list>] [--repeat=<n>] [--turns=<n>] [--max-warp=<n>] [--baseline=<file>] [--save-baseline] [--threshold=<pct>] [--json=<file>]
+
+Options:
+    --sizes=<list>      Comma separated encounter sizes [default: 10,100,1000,10000]
+    --repeat=<n>        Runs per size, the fastest is kept [default: 3]
+    --turns=<n>         Number of next_turn calls to time [default: 50]
+    --max-warp=<n>      Largest encounter to time_warp through a full round [default: 1000]
+    --baseline=<file>   Baseline to compare against [default: bench-baseline.json]
+    --save-baseline     Write the results to the baseline file
+    --threshold=<pct>   Slowdown over the baseline reported as a regression [default: 20]
+    --json=<file>       Also write the results as JSON
+"""
+
+import contextlib
+import json
+import os
+import pathlib
+import random
+import tempfile
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+from .__main__ import InitApp, DamageDialog, TagDialog, TagRemoveDialog, TimeWarpDialog
+from .common import Creature
+
+
+OPERATIONS = ["add", "clone", "damage", "tag_add", "tag_remove", "next_turn", "time_warp", "save", "load", "save_binary", "load_binary", "repaint"]
+
+
+@contextlib.contextmanager
+def accepting(dialog, **values):
+    def exec_(self):
+        self.__dict__.update(values)
+        return True
+
+    old = dialog.exec_
+    dialog.exec_ = exec_
+    try:
+        yield
+    finally:
+        dialog.exec_ = old
+
+
+@contextlib.contextmanager
+def saving_to(fname):
+    old = QtWidgets.QFileDialog.getSaveFileName
+    QtWidgets.QFileDialog.getSaveFileName = staticmethod(lambda *args, **kwargs: (fname, ""))
+    try:
+        yield
+    finally:
+        QtWidgets.QFileDialog.getSaveFileName = old
+
+
+def timed(f, *args, **kwargs):
+    start = time.perf_counter()
+    f(*args, **kwargs)
+    return (time.perf_counter() - start) * 1000
+
+
+def repaint_all(app):
+    view = app.creature_list
+    model = view.model()
+    delegate = view.itemDelegate()
+    option = QtWidgets.QStyleOptionViewItem()
+    option.initFrom(view)
+    option.rect = QtCore.QRect(0, 0, 1000, 30)
+    image = QtGui.QImage(option.rect.size(), QtGui.QImage.Format_ARGB32)
+    painter = QtGui.QPainter(image)
+    for row in range(model.rowCount()):
+        delegate.paint(painter, option, model.index(row, 0))
+    painter.end()
+
+
+def make_creatures(n):
+    return [
+        Creature(name=f"Creature{i}", max_hp_generator="2d8+4", initiative=random.randint(1, 30), xp=50)
+        for i in range(n)
+    ]
+
+
+def run_once(app, n, turns, max_warp, save_file):
+    app.creature_model.clear()
+    app.current_round = -1
+    results = {}
+
+    results["add"] = timed(app.add_creatures, make_creatures(n))
+    app.creature_list.selectAll()
+
+    results["clone"] = timed(app.clone_selected_creature)
+    app.creature_model.removeRows(n, app.creature_model.rowCount() - n)
+    app.creature_list.selectAll()
+
+    with accepting(DamageDialog, damage=1):
+        results["damage"] = timed(app.damage_selected_creatures)
+    with accepting(TagDialog, tag=("prone", None)):
+        results["tag_add"] = timed(app.add_tag_to_selected_creatures)
+    with accepting(TagRemoveDialog, tags=[("prone", None)]):
+        results["tag_remove"] = timed(app.remove_tags_from_selected_creatures)
+
+    results["next_turn"] = timed(lambda: [app.next_turn() for _ in range(turns)]) / turns
+
+    if n <= max_warp:
+        with accepting(TimeWarpDialog, time=1):
+            results["time_warp"] = timed(app.time_warp)
+
+    with saving_to(str(save_file)):
+        results["save"] = timed(app.save)
+    results["load"] = timed(app.load, fname=str(save_file))
+    with saving_to(str(save_file.with_suffix(".bzk"))):
+        results["save_binary"] = timed(app.save)
+    results["load_binary"] = timed(app.load, fname=str(save_file.with_suffix(".bzk")))
+
+    results["repaint"] = timed(repaint_all, app)
+    return results
+
+
+def run(app, sizes, repeat, turns, max_warp):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        save_file = pathlib.Path(tmp) / "bench.json"
+        for n in sizes:
+            runs = [run_once(app, n, turns, max_warp, save_file) for _ in range(repeat)]
+            results[str(n)] = {op: min(r[op] for r in runs) for op in OPERATIONS if op in runs[0]}
+            print(f"{n:>6} " + " ".join(f"{op}={ms:.2f}" for op, ms in results[str(n)].items()), flush=True)
+    return results
+
+
+def compare(results, baseline, threshold):
+    lines = [f"{'size':>6} {'operation':<11} {'ms':>10} {'baseline':>10} {'change':>8}"]
+    regressions = 0
+    for size, ops in results.items():
+        for op, ms in ops.items():
+            base = baseline.get(size, {}).get(op)
+            if base is None:
+                lines.append(f"{size:>6} {op:<11} {ms:>10.2f} {'-':>10} {'-':>8}")
+                continue
+            change = (ms - base) / base * 100 if base else 0
+            flag = ""
+            if change > threshold:
+                flag = " REGRESSION"
+                regressions += 1
+            lines.append(f"{size:>6} {op:<11} {ms:>10.2f} {base:>10.2f} {change:>+7.1f}%{flag}")
+    return "\n".join(lines), regressions
+
+
+if __name__ == "__main__":
+    import docopt
+
+    args = docopt.docopt(__doc__)
+
+    random.seed(0)
+    app = InitApp()
+    app.synchronous = True
+    results = run(
+        app,
+        [int(n) for n in args["--sizes"].split(",")],
+        int(args["--repeat"]),
+        int(args["--turns"]),
+        int(args["--max-warp"])
+    )
+
+    try:
+        with open(args["--baseline"]) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        baseline = None
+
+    if baseline is not None:
+        report, regressions = compare(results, baseline, float(args["--threshold"]))
+        print()
+        print(report)
+        if regressions:
+            print(f"\n{regressions} regression(s) over {args['--threshold']}%")
+
+    if args["--save-baseline"]:
+        with open(args["--baseline"], "w") as f:
+            json.dump(results, f, indent=4)
+
+    if args["--json"]:
+        with open(args["--json"], "w") as f:
+            json.dump(results, f, indent=4)
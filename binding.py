@@ -0,0 +1,131 @@
+class NameIndex:
+    def __init__(self):
+        self.by_name = {}
+        self.names = {}
+
+    def __contains__(self, item):
+        return item in self.names
+
+    def add(self, item, name):
+        self.remove(item)
+        self.names[item] = name
+        self.by_name.setdefault(name, {})[item] = None
+
+    def remove(self, item):
+        name = self.names.pop(item, None)
+        if name is None:
+            return
+        items = self.by_name[name]
+        del items[item]
+        if not items:
+            del self.by_name[name]
+
+    def pop(self, name):
+        items = self.by_name.get(name)
+        if not items:
+            return None
+        item = next(iter(items))
+        self.remove(item)
+        return item
+
+    def clear(self):
+        self.by_name.clear()
+        self.names.clear()
+
+
+class BindingIndex:
+    def __init__(self, key):
+        self.key = key
+        self.creatures = {}
+        self.tokens = {}
+        self.remembered = {}
+        self.token_names = {}
+        self.unbound_creatures = NameIndex()
+        self.unbound_tokens = NameIndex()
+
+    def bind(self, token, creature):
+        self.unbound_creatures.remove(creature)
+        self.unbound_tokens.remove(token)
+        remembered = self.remembered_token(creature)
+        if self.remembered.get(remembered) is creature:
+            del self.remembered[remembered]
+        self.creatures[token] = creature
+        self.tokens[creature] = token
+        creature.pa_tokens[self.key] = token
+        return token, creature
+
+    def remembered_token(self, creature):
+        return creature.pa_tokens.get(self.key)
+
+    def add_token(self, token, name):
+        self.token_names[token] = name.lower()
+        if token in self.creatures:
+            return None
+        if token in self.remembered:
+            return self.bind(token, self.remembered[token])
+        creature = self.unbound_creatures.pop(name.lower())
+        if creature is not None:
+            return self.bind(token, creature)
+        self.unbound_tokens.add(token, name.lower())
+        return None
+
+    def remove_token(self, token):
+        self.unbound_tokens.remove(token)
+        self.token_names.pop(token, None)
+        creature = self.creatures.pop(token, None)
+        if creature is not None:
+            del self.tokens[creature]
+            self.add_creature(creature)
+        return creature
+
+    def rename_token(self, token, name):
+        self.token_names[token] = name.lower()
+        if token in self.unbound_tokens:
+            self.unbound_tokens.remove(token)
+            return self.add_token(token, name)
+        return None
+
+    def add_creature(self, creature):
+        if creature in self.tokens:
+            return None
+        remembered = self.remembered_token(creature)
+        if remembered in self.unbound_tokens:
+            return self.bind(remembered, creature)
+        token = self.unbound_tokens.pop(creature.name.lower())
+        if token is not None:
+            return self.bind(token, creature)
+        self.add_unbound_creature(creature)
+        return None
+
+    def add_unbound_creature(self, creature):
+        self.unbound_creatures.add(creature, creature.name.lower())
+        remembered = self.remembered_token(creature)
+        if remembered is not None:
+            self.remembered[remembered] = creature
+
+    def remove_creature(self, creature):
+        self.unbound_creatures.remove(creature)
+        remembered = self.remembered_token(creature)
+        if self.remembered.get(remembered) is creature:
+            del self.remembered[remembered]
+        token = self.tokens.pop(creature, None)
+        if token is not None:
+            del self.creatures[token]
+            self.add_token(token, self.token_names[token])
+        return token
+
+    def clear_tokens(self):
+        for creature in list(self.tokens):
+            self.add_unbound_creature(creature)
+        self.creatures.clear()
+        self.tokens.clear()
+        self.token_names.clear()
+        self.unbound_tokens.clear()
+
+    def clear(self):
+        self.creatures.clear()
+        self.tokens.clear()
+        self.remembered.clear()
+        self.token_names.clear()
+        self.unbound_creatures.clear()
+        self.unbound_tokens.clear()
@@ -0,0 +1,149 @@
+import collections
+
+from PyQt5 import QtCore
+
+from .history import freeze, thaw
+
+
+Changeset = collections.namedtuple("Changeset", "action added removed changed reset before after")
+
+FIELD_KINDS = {
+    "evaluated_max_hp": "hp",
+    "max_hp_generator": "hp",
+    "damage_taken": "hp",
+    "member_max_hp": "hp",
+    "member_damage": "hp",
+    "count": "hp",
+    "member_tags": "tags",
+    "completed_round": "turn",
+    "death_saves_success": "death_saves",
+    "death_saves_failure": "death_saves"
+}
+
+
+def changed_kinds(before, after):
+    before, after = thaw(before), thaw(after)
+    return frozenset(FIELD_KINDS.get(field, field) for field in before.keys() | after.keys() if before.get(field) != after.get(field))
+
+
+class NullJournal:
+    def inserted(self, row, records):
+        pass
+
+    def removed(self, row, records):
+        pass
+
+    def changed(self, id, before, after):
+        pass
+
+
+class ChangeBus:
+    def __init__(self, creature_model, journal=NullJournal()):
+        self.creature_model = creature_model
+        self.journal = journal
+        self.records = {}
+        self.subscribers = []
+        self.depth = 0
+        self.action = None
+        self.before = None
+        self.clear()
+
+        self.creature_model.rowsInserted.connect(self.on_rows_inserted)
+        self.creature_model.rowsAboutToBeRemoved.connect(self.on_rows_about_to_be_removed)
+        self.creature_model.modelAboutToBeReset.connect(self.on_model_about_to_be_reset)
+        self.creature_model.modelReset.connect(self.on_model_reset)
+        self.creature_model.dataChanged.connect(self.on_data_changed)
+        for row in range(self.creature_model.rowCount()):
+            creature = self.creature(row)
+            self.records[creature.id] = freeze(creature)
+
+    def clear(self):
+        self.added = {}
+        self.removed = {}
+        self.changes = {}
+        self.was_reset = False
+
+    def subscribe(self, subscriber):
+        self.subscribers.append(subscriber)
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.remove(subscriber)
+
+    def creature(self, row):
+        return self.creature_model.index(row, 0).data(QtCore.Qt.UserRole)
+
+    def begin(self, action, state):
+        if not self.depth:
+            self.action = action
+            self.before = state
+        self.depth += 1
+
+    def end(self, state):
+        self.depth -= 1
+        if not self.depth:
+            self.publish(self.action, self.before, state)
+
+    def on_rows_inserted(self, parent, first, last):
+        records = []
+        for row in range(first, last + 1):
+            creature = self.creature(row)
+            record = self.records[creature.id] = freeze(creature)
+            records.append(record)
+            self.added[creature.id] = creature
+        self.journal.inserted(first, records)
+        self.flush()
+
+    def on_rows_about_to_be_removed(self, parent, first, last):
+        records = []
+        for row in range(first, last + 1):
+            creature = self.creature(row)
+            records.append(self.records.pop(creature.id, None) or freeze(creature))
+            if self.added.pop(creature.id, None) is None:
+                self.removed[creature.id] = creature
+            self.changes.pop(creature.id, None)
+        self.journal.removed(first, records)
+        self.flush()
+
+    def on_model_about_to_be_reset(self):
+        if self.creature_model.rowCount():
+            self.on_rows_about_to_be_removed(QtCore.QModelIndex(), 0, self.creature_model.rowCount() - 1)
+
+    def on_model_reset(self):
+        self.records.clear()
+        self.clear()
+        self.was_reset = True
+        self.flush()
+
+    def on_data_changed(self, top_left, bottom_right):
+        for row in range(top_left.row(), bottom_right.row() + 1):
+            creature = self.creature(row)
+            before = self.records.get(creature.id)
+            after = self.records[creature.id] = freeze(creature)
+            if before is None:
+                continue
+            self.journal.changed(creature.id, before, after)
+            if creature.id in self.added:
+                continue
+            change = self.changes.get(creature.id)
+            if change is None:
+                self.changes[creature.id] = [creature, before, after]
+            else:
+                change[2] = after
+        self.flush()
+
+    def flush(self):
+        if not self.depth:
+            self.publish(None, None, None)
+
+    def publish(self, action, before, after):
+        changed = {}
+        for id, (creature, first, last) in self.changes.items():
+            kinds = changed_kinds(first, last)
+            if kinds:
+                changed[id] = creature, kinds
+        changeset = Changeset(action, self.added, self.removed, changed, self.was_reset, before, after)
+        self.clear()
+        if not (changeset.added or changeset.removed or changeset.changed or changeset.reset or before != after):
+            return
+        for subscriber in list(self.subscribers):
+            subscriber(changeset)
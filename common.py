@@ -1,20 +1,95 @@
 import sly
+import copy
 import dataclasses
 import enum
+import heapq
+import json
+import operator
+import pathlib
 import random
+import uuid
+
+
+BASE_DIR = pathlib.Path("/home/matthew/D&D/Bazooka")
+SAVES_DIR = BASE_DIR / "Saves"
+SHEETS_DIR = BASE_DIR / "Sheets"
+CACHE_DIR = BASE_DIR / "Cache"
+
+LOADED_STAT_SHEETS = {}
+
+CONDITIONS = [
+    "blinded",
+    "charmed",
+    "deafened",
+    *[f"exhaustion-{i}" for i in range(1, 6)],
+    "frightened",
+    "grappled",
+    "incapacitated",
+    "invisible",
+    "paralysed",
+    "petrified",
+    "poisoned",
+    "prone",
+    "restrained",
+    "stunned",
+    "unconscious"
+]
+
+
+def load_stat_from_sheet(sheet, name):
+    if sheet not in LOADED_STAT_SHEETS:
+        with open(SHEETS_DIR / (sheet + ".json")) as f:
+            LOADED_STAT_SHEETS[sheet] = json.load(f)
+    return LOADED_STAT_SHEETS[sheet][name]
 
 
 class DEvalMode(enum.Enum):
     normal, average = range(2)
 
 
+COMPARISONS = {
+    ">=": operator.ge,
+    "<=": operator.le,
+    ">": operator.gt,
+    "<": operator.lt,
+    "=": operator.eq
+}
+
+
+def keep_highest(rolls, keep):
+    if keep * 2 > len(rolls):
+        return sum(rolls) - sum(heapq.nsmallest(len(rolls) - keep, rolls))
+    return sum(heapq.nlargest(keep, rolls))
+
+
+def average_keep_highest(count, sides, keep):
+    # The top k dice contribute min(k, #dice >= x) for every threshold x
+    total = 0
+    for x in range(1, sides + 1):
+        p = (sides - x + 1) / sides
+        pmf = (1 - p) ** count
+        at_least = 1 - pmf
+        for t in range(1, keep + 1):
+            total += at_least
+            pmf *= (count - t + 1) / t * p / (1 - p) if p < 1 else 0
+            at_least -= pmf
+    return total
+
+
 class DLexer(sly.Lexer):
-    tokens = {NUMBER, D, PLUS, MINUS, LPAREN, RPAREN}
+    tokens = {NUMBER, D, KH, KL, DH, DL, PLUS, MINUS, TIMES, DIVIDE, COMPARE, LPAREN, RPAREN}
 
     NUMBER = r"\d+"
+    DH = "dh"
+    DL = "dl"
     D = "d"
+    KL = "kl"
+    KH = "kh?"
     PLUS = r"\+"
     MINUS = "-"
+    TIMES = r"\*"
+    DIVIDE = "/"
+    COMPARE = "[<>]=?|="
     LPAREN = r"\("
     RPAREN = r"\)"
 
@@ -30,21 +105,36 @@ class DLexer(sly.Lexer):
 class DParser(sly.Parser):
     tokens = DLexer.tokens
 
-    def __init__(self, mode):
+    def __init__(self, mode, rng=random):
         super().__init__()
         self.mode = mode
+        self.rng = rng
 
-    @_("factor")
+    @_("term")
     def expr(self, p):
-        return p.factor
+        return p.term
 
-    @_("expr PLUS factor")
+    @_("expr PLUS term")
     def expr(self, p):
-        return p.expr + p.factor
+        return p.expr + p.term
 
-    @_("expr MINUS factor")
+    @_("expr MINUS term")
     def expr(self, p):
-        return p.expr - p.factor
+        return p.expr - p.term
+
+    @_("factor")
+    def term(self, p):
+        return p.factor
+
+    @_("term TIMES factor")
+    def term(self, p):
+        return p.term * p.factor
+
+    @_("term DIVIDE factor")
+    def term(self, p):
+        if not p.factor:
+            raise self.DivisionError()
+        return p.term // p.factor
 
     @_("atom")
     def factor(self, p):
@@ -56,12 +146,49 @@ class DParser(sly.Parser):
 
     @_("atom D atom")
     def factor(self, p):
+        return self.keep(p.atom0, p.atom1, p.atom0, True)
+
+    @_("atom D atom KH atom")
+    def factor(self, p):
+        return self.keep(p.atom0, p.atom1, p.atom2, True)
+
+    @_("atom D atom KL atom")
+    def factor(self, p):
+        return self.keep(p.atom0, p.atom1, p.atom2, False)
+
+    @_("atom D atom DH atom")
+    def factor(self, p):
+        return self.keep(p.atom0, p.atom1, p.atom0 - p.atom2, False)
+
+    @_("atom D atom DL atom")
+    def factor(self, p):
+        return self.keep(p.atom0, p.atom1, p.atom0 - p.atom2, True)
+
+    @_("atom D atom COMPARE atom")
+    def factor(self, p):
+        compare = COMPARISONS[p.COMPARE]
         if not p.atom1:
             return 0
         if self.mode is DEvalMode.normal:
-            return sum(random.randrange(1, p.atom1 + 1) for i in range(p.atom0))
-        else:
-            return p.atom0 * (p.atom1 + 1) / 2
+            return sum(compare(self.rng.randrange(1, p.atom1 + 1), p.atom2) for i in range(p.atom0))
+        sides = int(p.atom1)
+        return p.atom0 * sum(compare(x, p.atom2) for x in range(1, sides + 1)) / sides
+
+    def keep(self, count, sides, keep, highest):
+        keep = max(0, min(keep, count))
+        if not sides or not keep:
+            return 0
+        if self.mode is DEvalMode.normal:
+            rolls = [self.rng.randrange(1, sides + 1) for i in range(count)]
+            if keep == count:
+                return sum(rolls)
+            return keep_highest(rolls, keep) if highest else -keep_highest([-r for r in rolls], keep)
+        if keep == count:
+            return count * (sides + 1) / 2
+        count, sides, keep = int(count), int(sides), int(keep)
+        if highest:
+            return average_keep_highest(count, sides, keep)
+        return count * (sides + 1) / 2 - average_keep_highest(count, sides, count - keep)
 
     @_("NUMBER")
     def atom(self, p):
@@ -77,16 +204,42 @@ class DParser(sly.Parser):
     class EOFError(ParserError):
         pass
 
+    class DivisionError(ParserError):
+        pass
+
     def error(self, p):
         if not p:
             raise self.EOFError()
         raise self.ParserError()
 
 
-def d_eval(str, mode=DEvalMode.normal):
+def new_creature_id():
+    return uuid.uuid4().hex
+
+
+def d_eval(str, mode=DEvalMode.normal, rng=random):
     if not str:
         return None
-    return int(DParser(mode).parse(DLexer().tokenize(str)))
+    return int(DParser(mode, rng).parse(DLexer().tokenize(str)))
+
+
+def roll_hp(generator, rng=random):
+    try:
+        return d_eval(generator, rng=rng), None
+    except (DLexer.LexerError, DParser.ParserError):
+        return None, f"Invalid HP expression {generator!r}"
+
+
+def name_stem(name):
+    return name.rstrip("0123456789") or name
+
+
+def group_key(creature):
+    return name_stem(creature.name), creature.max_hp_generator, creature.xp, creature.initiative, creature.saves
+
+
+def groupable(creatures):
+    return len(creatures) > 1 and all(group_key(c) == group_key(creatures[0]) for c in creatures)
 
 
 @dataclasses.dataclass
@@ -101,15 +254,36 @@ class Creature:
     tags: list = dataclasses.field(default_factory=list)
     completed_round: int = -1
     xp: int = None
+    saves: dict = dataclasses.field(default_factory=dict)
+    hp_error: str = None
+    pa_tokens: dict = dataclasses.field(default_factory=dict)
+    id: str = dataclasses.field(default_factory=new_creature_id)
+
+    @property
+    def label(self):
+        return self.name
+
+    @property
+    def total_xp(self):
+        return self.xp or 0
 
     @property
     def max_hp(self):
-        if self.evaluated_max_hp is None:
-            self.evaluated_max_hp = d_eval(self.max_hp_generator)
-            if self.evaluated_max_hp is not None:
-                self.damage_taken = min(self.evaluated_max_hp, self.damage_taken)
         return self.evaluated_max_hp
 
+    def hp_rolls_needed(self):
+        return int(bool(self.max_hp_generator) and self.evaluated_max_hp is None and self.hp_error is None)
+
+    def set_rolled_hp(self, rolls):
+        (self.evaluated_max_hp, self.hp_error), = rolls
+        if self.evaluated_max_hp is not None:
+            self.damage_taken = min(self.evaluated_max_hp, self.damage_taken)
+
+    def materialize_hp(self, rng=random):
+        n = self.hp_rolls_needed()
+        if n:
+            self.set_rolled_hp([roll_hp(self.max_hp_generator, rng) for _ in range(n)])
+
     @property
     def hp(self):
         if self.max_hp is not None:
@@ -132,15 +306,166 @@ class Creature:
 
     @classmethod
     def from_json(cls, data):
+        if "count" in data and cls is Creature:
+            return CreatureGroup.from_json(data)
         data.pop("hp", None)
         obj = cls(**data)
         obj.tags = [tuple(t) for t in obj.tags]
         return obj
 
     def clone(self):
-        creature = self.from_json(self.to_json())
+        creature = self.from_json(copy.deepcopy(self.to_json()))
         creature.evaluated_max_hp = None
+        creature.pa_tokens = {}
+        creature.id = new_creature_id()
         return creature
 
     def __hash__(self):
         return id(self)
+
+
+@dataclasses.dataclass(eq=False)
+class CreatureGroup(Creature):
+    count: int = 1
+    member_max_hp: list = dataclasses.field(default_factory=list)
+    member_damage: list = dataclasses.field(default_factory=list)
+    member_tags: list = dataclasses.field(default_factory=list)
+
+    @classmethod
+    def from_creatures(cls, creatures):
+        if not groupable(creatures):
+            raise ValueError("Only creatures of the same kind can be grouped")
+        template = creatures[0]
+        shared = [t for t in template.tags if all(t in c.tags for c in creatures)]
+        return cls(
+            name=name_stem(template.name),
+            initiative=template.initiative,
+            max_hp_generator=template.max_hp_generator,
+            tags=shared,
+            completed_round=template.completed_round,
+            xp=template.xp,
+            saves=dict(template.saves),
+            count=len(creatures),
+            member_max_hp=[c.max_hp for c in creatures],
+            member_damage=[c.damage_taken for c in creatures],
+            member_tags=[[t for t in c.tags if t not in shared] for c in creatures]
+        )
+
+    @classmethod
+    def from_template(cls, template, count):
+        return cls(
+            name=template.name,
+            initiative=template.initiative,
+            max_hp_generator=template.max_hp_generator,
+            tags=list(template.tags),
+            xp=template.xp,
+            saves=dict(template.saves),
+            count=count
+        )
+
+    def __post_init__(self):
+        self.ensure_members()
+
+    def ensure_members(self):
+        while len(self.member_max_hp) < self.count:
+            self.member_max_hp.append(None)
+        while len(self.member_damage) < self.count:
+            self.member_damage.append(0)
+        while len(self.member_tags) < self.count:
+            self.member_tags.append([])
+
+    @property
+    def label(self):
+        return f"{self.name} \u00d7{self.alive}/{self.count}"
+
+    @property
+    def total_xp(self):
+        return (self.xp or 0) * self.count
+
+    @property
+    def max_hp(self):
+        if None in self.member_max_hp:
+            return None
+        return sum(self.member_max_hp)
+
+    def hp_rolls_needed(self):
+        if not self.max_hp_generator or self.hp_error is not None:
+            return 0
+        return self.member_max_hp.count(None)
+
+    def set_rolled_hp(self, rolls):
+        rolls = iter(rolls)
+        for i, max_hp in enumerate(self.member_max_hp):
+            if max_hp is None:
+                self.member_max_hp[i], error = next(rolls)
+                self.hp_error = self.hp_error or error
+                if self.member_max_hp[i] is not None:
+                    self.member_damage[i] = min(self.member_max_hp[i], self.member_damage[i])
+        self.damage_taken = sum(self.member_damage)
+
+    @property
+    def hp(self):
+        if self.max_hp is not None:
+            return sum(self.member_hp(i) for i in range(self.count))
+
+    @property
+    def alive(self):
+        return sum(1 for i in range(self.count) if self.member_hp(i) != 0)
+
+    def member_hp(self, i):
+        if self.member_max_hp[i] is not None:
+            return max(0, min(self.member_max_hp[i], self.member_max_hp[i] - self.member_damage[i]))
+
+    def apply_damage(self, damage):
+        self.apply_member_damage(range(self.count), damage)
+
+    def apply_member_damage(self, members, damage):
+        for i in members:
+            if self.member_max_hp[i] is not None:
+                self.member_damage[i] = min(self.member_max_hp[i], max(0, self.member_damage[i] + damage))
+            else:
+                self.member_damage[i] = max(0, self.member_damage[i] + damage)
+        self.damage_taken = sum(self.member_damage)
+
+    def add_member_tag(self, members, tag):
+        for i in members:
+            if tag not in self.member_tags[i]:
+                self.member_tags[i].append(tag)
+
+    def remove_member_tags(self, members, tags):
+        for i in members:
+            self.member_tags[i] = [t for t in self.member_tags[i] if t not in tags]
+
+    def start_turn(self):
+        super().start_turn()
+        self.member_tags = [[(n, None if t is None else (t - 1)) for n, t in tags if t is None or t > 1] for tags in self.member_tags]
+
+    def members(self):
+        return [
+            Creature(
+                name=f"{self.name}{i + 1}",
+                initiative=self.initiative,
+                evaluated_max_hp=self.member_max_hp[i],
+                max_hp_generator=self.max_hp_generator,
+                damage_taken=self.member_damage[i],
+                tags=self.tags + self.member_tags[i],
+                completed_round=self.completed_round,
+                xp=self.xp,
+                saves=dict(self.saves)
+            )
+            for i in range(self.count)
+        ]
+
+    @classmethod
+    def from_json(cls, data):
+        obj = super().from_json(data)
+        obj.member_tags = [[tuple(t) for t in tags] for tags in obj.member_tags]
+        return obj
+
+    def clone(self):
+        group = super().clone()
+        group.member_max_hp = [None] * group.count
+        group.member_damage = [0] * group.count
+        group.member_tags = [[] for _ in range(group.count)]
+        group.damage_taken = 0
+        return group
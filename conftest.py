@@ -0,0 +1,9 @@
+import importlib.machinery
+import importlib.util
+import pathlib
+import sys
+
+
+package = importlib.util.module_from_spec(importlib.machinery.ModuleSpec("bazooka", None, is_package=True))
+package.__path__ = [str(pathlib.Path(__file__).parent)]
+sys.modules.setdefault("bazooka", package)
@@ -0,0 +1,201 @@
+"""
+Usage:
+    fakeserver.py [--host=<host>] [--port=<port>] [--tokens=<n>]
+
+Options:
+    --host=<host>   Host to listen on [default: 127.0.0.1]
+    --port=<port>   Port to listen on [default: 8000]
+    --tokens=<n>    Number of synthetic tokens on the board [default: 10]
+"""
+
+import asyncio
+import collections
+import threading
+import uuid
+
+import socketio
+from aiohttp import web
+
+
+NAMESPACE = "/planarally"
+
+
+def make_token(name, layer="tokens"):
+    return {
+        "uuid": str(uuid.uuid4()),
+        "name": name,
+        "layer": layer,
+        "floor": "ground",
+        "src": "/static/img/token.png",
+        "badge": 0,
+        "show_badge": False,
+        "is_token": True,
+        "is_defeated": False,
+        "fill_colour": "rgb(0, 0, 0)",
+        "x": 0,
+        "y": 0,
+        "w": 50,
+        "h": 50,
+        "trackers": [],
+        "auras": [],
+        "owners": [],
+        "options": "{}"
+    }
+
+
+def make_board(n):
+    return [make_token(f"Token{i}") for i in range(n)]
+
+
+class FakePlanarAlly:
+    def __init__(self, tokens=(), location=1):
+        self.location = location
+        self.tokens = {token["uuid"]: token for token in tokens}
+        self.initiative = {}
+        self.received = collections.Counter()
+        self.received_total = 0
+
+        self.sio = socketio.AsyncServer(async_mode="aiohttp")
+        self.app = web.Application()
+        self.app.router.add_post("/api/login", self.login)
+        self.sio.attach(self.app)
+
+        self.loop = None
+        self.runner = None
+        self.thread = None
+
+        self.sio.on("connect", self.on_connect, namespace=NAMESPACE)
+        for event, handler in {
+            "Location.Load": self.on_location_load,
+            "Shape.Options.Tracker.Create": self.on_tracker_create,
+            "Shape.Options.Tracker.Update": self.on_tracker_update,
+            "Shape.Options.Aura.Create": self.on_aura_create,
+            "Shape.Options.Aura.Update": self.on_aura_update,
+            "Shape.Options.Defeated.Set": self.on_option("is_defeated"),
+            "Shape.Options.Token.Set": self.on_option("is_token"),
+            "Shape.Options.FillColour.Set": self.on_option("fill_colour"),
+            "Initiative.Add": self.on_initiative_add,
+            "Initiative.Value.Set": self.on_initiative_value,
+            "Initiative.Option.Update": self.on_initiative_option,
+            "Initiative.Remove": self.on_initiative_remove
+        }.items():
+            self.sio.on(event, self.counted(event, handler), namespace=NAMESPACE)
+
+    def counted(self, event, handler):
+        async def wrapper(sid, data=None):
+            self.received[event] += 1
+            self.received_total += 1
+            await handler(sid, data)
+        return wrapper
+
+    async def login(self, request):
+        response = web.json_response({})
+        response.set_cookie("AIOHTTP_SESSION", "fake")
+        return response
+
+    async def on_connect(self, sid, environ, auth=None):
+        await self.sio.enter_room(sid, "room", namespace=NAMESPACE)
+
+    async def on_location_load(self, sid, data):
+        await self.sio.emit("Location.Set", {"id": self.location}, to=sid, namespace=NAMESPACE)
+        await self.sio.emit("Board.Floor.Set", self.floor(), to=sid, namespace=NAMESPACE)
+        await self.sio.emit("Initiative.Set", {"location": self.location, "data": list(self.initiative.values())}, to=sid, namespace=NAMESPACE)
+
+    def floor(self):
+        layers = {"dm": [], "tokens": []}
+        for token in self.tokens.values():
+            layers.setdefault(token["layer"], []).append(token)
+        return {"name": "ground", "layers": [{"name": name, "shapes": shapes} for name, shapes in layers.items()]}
+
+    async def on_tracker_create(self, sid, data):
+        self.tokens[data["shape"]]["trackers"].append(dict(data))
+
+    async def on_tracker_update(self, sid, data):
+        for tracker in self.tokens[data["shape"]]["trackers"]:
+            if tracker["uuid"] == data["uuid"]:
+                tracker.update(data)
+
+    async def on_aura_create(self, sid, data):
+        self.tokens[data["shape"]]["auras"].append(dict(data))
+
+    async def on_aura_update(self, sid, data):
+        for aura in self.tokens[data["shape"]]["auras"]:
+            if aura["uuid"] == data["uuid"]:
+                aura.update(data)
+
+    def on_option(self, key):
+        async def handler(sid, data):
+            self.tokens[data["shape"]][key] = data["value"]
+        return handler
+
+    async def on_initiative_add(self, sid, data):
+        self.initiative[data["shape"]] = dict(data)
+
+    async def on_initiative_value(self, sid, data):
+        self.initiative[data["shape"]]["initiative"] = data["value"]
+
+    async def on_initiative_option(self, sid, data):
+        self.initiative[data["shape"]][data["option"]] = data["value"]
+
+    async def on_initiative_remove(self, sid, data):
+        self.initiative.pop(data, None)
+
+    async def broadcast(self, event, data):
+        await self.sio.emit(event, data, room="room", namespace=NAMESPACE)
+
+    def call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def add_shape(self, token):
+        self.tokens[token["uuid"]] = token
+        self.call(self.broadcast("Shape.Add", token))
+
+    def remove_shapes(self, uuids):
+        for uuid in uuids:
+            self.tokens.pop(uuid, None)
+        self.call(self.broadcast("Shapes.Remove", list(uuids)))
+
+    def rename_shape(self, uuid, name):
+        self.tokens[uuid]["name"] = name
+        self.call(self.broadcast("Shape.Options.Name.Set", {"shape": uuid, "value": name}))
+
+    async def serve(self, host, port):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        return site._server.sockets[0].getsockname()[1]
+
+    def start(self, host="127.0.0.1", port=0):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="fake-planarally", daemon=True)
+        self.thread.start()
+        port = self.call(self.serve(host, port))
+        return f"http://{host}:{port}"
+
+    async def shutdown(self):
+        await self.sio.shutdown()
+        await self.runner.cleanup()
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stop(self):
+        self.call(self.shutdown())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=5)
+
+
+if __name__ == "__main__":
+    import docopt
+
+    args = docopt.docopt(__doc__)
+
+    server = FakePlanarAlly(make_board(int(args["--tokens"])))
+    url = server.start(args["--host"], int(args["--port"]))
+    print(f"Serving {len(server.tokens)} tokens, use {url}/game/user/room")
+    try:
+        server.thread.join()
+    except KeyboardInterrupt:
+        server.stop()
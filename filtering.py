@@ -0,0 +1,135 @@
+import collections
+import operator
+import re
+
+
+OPS = {
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "=": operator.eq
+}
+
+TERM = re.compile(
+    r"(?P<field>hp|initiative|init)(?P<op><=|>=|<|>|=)(?P<value>-?\d+)(?P<percent>%?)$"
+    r"|name~(?P<name>.+)$"
+    r"|(?:tag:)?(?P<tag>[^\s<>=~:]+)$"
+)
+
+FilterKeys = collections.namedtuple("FilterKeys", "name tags hp hp_pct initiative")
+
+
+class FilterError(ValueError):
+    pass
+
+
+def parse_filter(text):
+    terms = []
+    for word in text.split():
+        m = TERM.match(word.lower())
+        if m is None:
+            raise FilterError(f"Invalid filter term {word!r}")
+        if m["tag"]:
+            terms.append(("tags", None, m["tag"]))
+        elif m["name"]:
+            terms.append(("name", None, m["name"]))
+        elif m["field"] == "hp":
+            terms.append(("hp_pct" if m["percent"] else "hp", OPS[m["op"]], int(m["value"])))
+        elif m["percent"]:
+            raise FilterError(f"Invalid filter term {word!r}")
+        else:
+            terms.append(("initiative", OPS[m["op"]], int(m["value"])))
+    return terms
+
+
+def creature_keys(creature):
+    hp = creature.hp
+    return FilterKeys(
+        creature.name.lower(),
+        frozenset(t for t, _ in creature.tags),
+        hp,
+        None if hp is None else int(hp * 100 / creature.max_hp) if creature.max_hp else 0,
+        creature.initiative
+    )
+
+
+def term_matches(value, op, arg):
+    if op is None:
+        return arg in value
+    return value is not None and op(value, arg)
+
+
+class FilterIndex:
+    def __init__(self):
+        self.keys = {}
+        self.indexes = {field: {} for field in FilterKeys._fields}
+        self.terms = []
+        self.visible = None
+
+    def index_values(self, field, value):
+        if field == "tags":
+            return value
+        return () if value is None else (value,)
+
+    def update(self, id, keys):
+        old = self.keys.get(id)
+        if old == keys:
+            return False
+        if old is not None:
+            self.unindex(id, old)
+        self.keys[id] = keys
+        for field, value in zip(FilterKeys._fields, keys):
+            for v in self.index_values(field, value):
+                self.indexes[field].setdefault(v, set()).add(id)
+        if self.visible is not None:
+            if self.matches(keys):
+                self.visible.add(id)
+            else:
+                self.visible.discard(id)
+        return True
+
+    def unindex(self, id, keys):
+        for field, value in zip(FilterKeys._fields, keys):
+            for v in self.index_values(field, value):
+                ids = self.indexes[field][v]
+                ids.discard(id)
+                if not ids:
+                    del self.indexes[field][v]
+
+    def remove(self, id):
+        keys = self.keys.pop(id, None)
+        if keys is not None:
+            self.unindex(id, keys)
+        if self.visible is not None:
+            self.visible.discard(id)
+
+    def clear(self):
+        self.keys.clear()
+        for index in self.indexes.values():
+            index.clear()
+        if self.visible is not None:
+            self.visible.clear()
+
+    def matches(self, keys):
+        return all(term_matches(getattr(keys, field), op, arg) for field, op, arg in self.terms)
+
+    def lookup(self, field, op, arg):
+        index = self.indexes[field]
+        if field == "tags":
+            return index.get(arg, set())
+        if field == "name":
+            return set().union(*(ids for name, ids in index.items() if arg in name))
+        return set().union(*(ids for value, ids in index.items() if op(value, arg)))
+
+    def set_terms(self, terms):
+        self.terms = terms
+        if not terms:
+            self.visible = None
+            return
+        matches = [self.lookup(*term) for term in terms]
+        matches.sort(key=len)
+        self.visible = matches[0].intersection(*matches[1:])
+
+    def accepts(self, id):
+        return self.visible is None or id in self.visible
@@ -0,0 +1,97 @@
+import collections
+import itertools
+import pickle
+
+
+Entry = collections.namedtuple("Entry", "label ops changes before after serial")
+
+
+def freeze(creature):
+    return pickle.dumps(creature.to_json(), pickle.HIGHEST_PROTOCOL)
+
+
+def thaw(record):
+    return pickle.loads(record)
+
+
+class History:
+    def __init__(self, depth=100):
+        self.undo_stack = collections.deque(maxlen=depth)
+        self.redo_stack = []
+        self.depth = 0
+        self.label = None
+        self.ops = []
+        self.changes = {}
+        self.before = None
+        self.suspended = False
+        self.serial = 0
+
+    def begin(self, label, state):
+        if not self.depth:
+            self.label = label
+            self.before = state
+        self.depth += 1
+
+    def commit(self, state):
+        self.depth -= 1
+        if self.depth:
+            return None
+        changes = {id: change for id, change in self.changes.items() if change[0] != change[1]}
+        entry = Entry(self.label, self.ops, changes, self.before, state, self.serial)
+        self.ops = []
+        self.changes = {}
+        if not entry.ops and not entry.changes and entry.before == entry.after:
+            return None
+        self.serial += 1
+        self.undo_stack.append(entry)
+        self.redo_stack.clear()
+        return entry
+
+    def rollback(self):
+        self.depth -= 1
+        if not self.depth:
+            self.ops = []
+            self.changes = {}
+
+    @property
+    def recording(self):
+        return self.depth and not self.suspended
+
+    def inserted(self, row, records):
+        if self.recording:
+            self.ops.append(("insert", row, records))
+
+    def removed(self, row, records):
+        if self.recording:
+            self.ops.append(("remove", row, records))
+
+    def changed(self, id, before, after):
+        if self.recording:
+            self.changes.setdefault(id, [before, after])[1] = after
+
+    def amend(self, since, patch):
+        for entry in itertools.chain(self.undo_stack, self.redo_stack):
+            if entry.serial < since:
+                continue
+            for _, _, records in entry.ops:
+                records[:] = map(patch, records)
+            for change in entry.changes.values():
+                change[:] = map(patch, change)
+
+    def undo(self):
+        if not self.undo_stack:
+            return None
+        entry = self.undo_stack.pop()
+        self.redo_stack.append(entry)
+        return entry
+
+    def redo(self):
+        if not self.redo_stack:
+            return None
+        entry = self.redo_stack.pop()
+        self.undo_stack.append(entry)
+        return entry
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack.clear()
@@ -0,0 +1,148 @@
+"""
+Usage:
+    loadtest.py [--tokens=<list>] [--creatures=<list>] [--changes=<n>] [--rooms=<n>] [--max-rate=<n>] [--json=<file>]
+
+Options:
+    --tokens=<list>     Comma separated token counts [default: 10,100,1000,5000]
+    --creatures=<list>  Comma separated creature counts [default: 10,100,1000]
+    --changes=<n>       Number of single creature changes to time [default: 20]
+    --rooms=<n>         Number of rooms synced from the same tracker [default: 1]
+    --max-rate=<n>      Outbound emit rate limit for the integration [default: 100000]
+    --json=<file>       Also write the results as JSON
+"""
+
+import json
+import pathlib
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from PyQt5 import QtCore, QtGui
+
+from .changes import ChangeBus
+from .common import Creature
+from .fakeserver import FakePlanarAlly, make_board
+from .planarally import PlanarAllyFeed, PlanarAllyIntegration
+
+
+def wait_until(app, condition, timeout=120):
+    end = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > end:
+            raise TimeoutError("Timed out waiting for the integration")
+        app.processEvents(QtCore.QEventLoop.AllEvents, 10)
+        time.sleep(0.001)
+
+
+def received(servers):
+    return sum(server.received_total for server in servers)
+
+
+def wait_until_idle(app, servers, integrations, settle=0.2, timeout=120):
+    last = [received(servers), time.monotonic()]
+
+    def idle():
+        if received(servers) != last[0]:
+            last[:] = received(servers), time.monotonic()
+        return (all(pa.board_ready and not pa.update_pending and not len(pa.transport.outbox) for pa in integrations)
+                and time.monotonic() - last[1] > settle)
+
+    wait_until(app, idle, timeout)
+
+
+def run_scenario(app, n_tokens, n_creatures, changes, rooms, max_rate, cache_dir):
+    servers = [FakePlanarAlly(make_board(n_tokens)) for _ in range(rooms)]
+    urls = [server.start() for server in servers]
+
+    model = QtGui.QStandardItemModel()
+    for i in range(n_creatures):
+        creature = Creature(name=f"Token{i}", max_hp_generator="20", tags=[("pa", None)])
+        creature.materialize_hp()
+        item = QtGui.QStandardItem()
+        item.setData(creature, QtCore.Qt.UserRole)
+        model.appendRow(item)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    feed = PlanarAllyFeed(model, ChangeBus(model))
+    integrations = [PlanarAllyIntegration(url, "user", "password", "room", feed, max_rate=max_rate, cache_dir=cache_dir) for url in urls]
+
+    timings = []
+
+    def timed_update_all(pa):
+        t = time.perf_counter()
+        pa.update_all()
+        timings.append(time.perf_counter() - t)
+
+    for pa in integrations:
+        pa.update_timer.timeout.disconnect()
+        pa.update_timer.timeout.connect(lambda pa=pa: timed_update_all(pa))
+
+    wait_until_idle(app, servers, integrations)
+    initial_sync = time.perf_counter() - start
+    initial_emits = received(servers)
+    memory = tracemalloc.get_traced_memory()[0]
+
+    timings.clear()
+    emits = []
+    for _ in range(changes):
+        before = received(servers)
+        item = model.item(random.randrange(n_creatures))
+        item.data(QtCore.Qt.UserRole).apply_damage(1)
+        item.emitDataChanged()
+        wait_until_idle(app, servers, integrations)
+        emits.append(received(servers) - before)
+
+    tracemalloc.stop()
+    for pa in integrations:
+        pa.close()
+    for server in servers:
+        server.stop()
+
+    timings.sort()
+    return {
+        "tokens": n_tokens,
+        "creatures": n_creatures,
+        "rooms": rooms,
+        "matched": sum(len(pa.bindings.creatures) for pa in integrations),
+        "initial_sync_s": initial_sync,
+        "initial_emits": initial_emits,
+        "memory_bytes": memory,
+        "update_all_mean_ms": statistics.mean(timings) * 1000 if timings else None,
+        "update_all_p95_ms": timings[int(len(timings) * 0.95)] * 1000 if timings else None,
+        "update_all_max_ms": timings[-1] * 1000 if timings else None,
+        "emits_per_change": statistics.mean(emits) if emits else None
+    }
+
+
+def format_row(result):
+    def ms(v):
+        return "-" if v is None else f"{v:.2f}"
+    return (f"{result['tokens']:>6} {result['creatures']:>9} {result['matched']:>7} "
+            f"{result['initial_sync_s']:>9.2f} {result['initial_emits']:>8} {result['memory_bytes'] / 1e6:>8.1f} "
+            f"{ms(result['update_all_mean_ms']):>8} {ms(result['update_all_p95_ms']):>8} {ms(result['update_all_max_ms']):>8} "
+            f"{ms(result['emits_per_change']):>8}")
+
+
+if __name__ == "__main__":
+    import docopt
+
+    args = docopt.docopt(__doc__)
+
+    app = QtCore.QCoreApplication(sys.argv)
+    results = []
+    print(f"{'tokens':>6} {'creatures':>9} {'matched':>7} {'sync (s)':>9} {'emits':>8} {'mem (MB)':>8} "
+          f"{'mean ms':>8} {'p95 ms':>8} {'max ms':>8} {'emits/ch':>8}")
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for n_tokens in map(int, args["--tokens"].split(",")):
+            for n_creatures in map(int, args["--creatures"].split(",")):
+                result = run_scenario(app, n_tokens, n_creatures, int(args["--changes"]), int(args["--rooms"]), int(args["--max-rate"]), pathlib.Path(cache_dir))
+                results.append(result)
+                print(format_row(result), flush=True)
+
+    if args["--json"]:
+        with open(args["--json"], "w") as f:
+            json.dump(results, f, indent=4)
@@ -0,0 +1,76 @@
+import bisect
+import collections
+import time
+
+
+MS_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+class Histogram:
+    def __init__(self, buckets=MS_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, p):
+        if not self.count:
+            return None
+        target = self.count * p
+        seen = 0
+        for bucket, count in zip(self.buckets + (self.max,), self.counts):
+            seen += count
+            if seen >= target:
+                return min(bucket, self.max)
+        return self.max
+
+    def to_json(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "max": self.max,
+            "buckets": {f"<={b}": c for b, c in zip(self.buckets, self.counts)} | {"inf": self.counts[-1]}
+        }
+
+
+class Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe((time.perf_counter() - self.start) * 1000)
+
+
+class SyncMetrics:
+    def __init__(self):
+        self.inbound = collections.Counter()
+        self.outbound = collections.Counter()
+        self.update_all = Histogram()
+        self.pairs_synced = Histogram(COUNT_BUCKETS)
+        self.started = time.time()
+
+    def time_update_all(self):
+        return Timer(self.update_all)
+
+    def to_json(self):
+        return {
+            "uptime_s": time.time() - self.started,
+            "inbound": dict(self.inbound),
+            "outbound": dict(self.outbound),
+            "update_all_ms": self.update_all.to_json(),
+            "pairs_synced": self.pairs_synced.to_json()
+        }
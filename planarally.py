@@ -1,262 +1,619 @@
-import socketio, requests, re, uuid
+import collections, json, logging, re, uuid
 from PyQt5 import QtCore, QtGui, QtWidgets
 
-from .common import Creature
+from .binding import BindingIndex
+from .common import Creature, CACHE_DIR
+from .metrics import SyncMetrics
+from .profiling import profiler
+from .transport import PlanarAllyTransport
+
+
+logger = logging.getLogger(__name__)
+
+SIDE_COLOURS = [
+    "rgb(12, 97, 20)", # dark green
+    "rgb(255, 215, 0)", # yellow
+    "rgb(32, 220, 219)", # cyan
+    "rgb(0, 2, 195)", # dark blue
+    "rgb(143, 0, 195)", # purple
+    "rgb(109, 59, 0)", # brown
+    "rgb(255, 147, 0)", # orange
+    "rgb(255, 255, 255)", # white
+    "rgb(0, 0, 0)", # black
+    "rgb(148, 148, 148)", # grey
+]
+
+SYNCED_KINDS = frozenset({"name", "hp", "tags", "initiative"})
+
+TokenState = collections.namedtuple("TokenState", "defeated fill_colour tracker aura")
+
+
+def token_state(creature):
+    tags = {t for t, _ in creature.tags}
+
+    defeated = bool(tags & {"unconscious", "defeated", "dead"})
+
+    sides = [i for i in range(10) if f"side-{i+1}" in tags]
+    fill_colour = SIDE_COLOURS[sides[0]] if sides else None
+
+    max_hp = creature.max_hp if creature.max_hp is not None else 1
+    hp = creature.hp if creature.hp is not None else 1
+    if creature.max_hp is None:
+        color = "#FF00FF"
+    elif hp == max_hp:
+        color = "#00FFFF"
+    elif hp > max_hp / 2:
+        color = "#00FF00"
+    else:
+        color = "#FFAA00"
+    if "acchp" not in tags:
+        if hp == 0:
+            hp = 0
+        elif hp <= max_hp / 2:
+            hp = 1
+        else:
+            hp = 2
+        max_hp = 2
+
+    range_ = None
+    aura_color = "rgba(0,0,0,0)"
+    public = False
+    if "darkvision-0" in tags:
+        range_ = 0, 0
+    elif "darkvision-60" in tags:
+        range_ = 55, 5
+    elif "darkvision-120" in tags:
+        range_ = 115, 5
+    elif "torch" in tags:
+        range_ = 20, 20
+        aura_color = "rgba(255, 186, 0, 0.5)" # orangey
+        public = True
+
+    return TokenState(
+        defeated,
+        fill_colour,
+        (hp, max_hp, color),
+        (range_ is not None, 0 if range_ is None else range_[0], 0 if range_ is None else range_[1], aura_color, public)
+    )
+
+
+class Token:
+    __slots__ = ("uuid", "name", "badge", "show_badge", "src", "floor", "layer", "is_token", "is_defeated", "fill_colour", "tracker", "aura")
+
+    def __init__(self, uuid, name=None, badge=None, show_badge=False, src=None, floor=None, layer=None, is_token=False,
+                 is_defeated=None, fill_colour=None, tracker=None, aura=None):
+        self.uuid = uuid
+        self.name = name
+        self.badge = badge
+        self.show_badge = show_badge
+        self.src = src
+        self.floor = floor
+        self.layer = layer
+        self.is_token = is_token
+        self.is_defeated = is_defeated
+        self.fill_colour = fill_colour
+        self.tracker = tracker
+        self.aura = aura
+
+    @classmethod
+    def from_shape(cls, shape):
+        return cls(
+            shape["uuid"],
+            shape.get("name"),
+            shape.get("badge"),
+            shape.get("show_badge", False),
+            shape.get("src"),
+            shape.get("floor"),
+            shape.get("layer"),
+            shape.get("is_token", False),
+            shape.get("is_defeated"),
+            shape.get("fill_colour"),
+            next((t["uuid"] for t in shape.get("trackers", ()) if t["name"] == "HP"), shape.get("tracker")),
+            next((a["uuid"] for a in shape.get("auras", ()) if a["name"] == "Vision"), shape.get("aura"))
+        )
 
+    def to_json(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
 
-class PlanarAllyIntegration:
-    def __init__(self, url, username, password, room, creature_model):
-        r = requests.post(f"{url}/api/login", json={"username": username, "password": password})
-        r.raise_for_status()
 
-        self.sio = socketio.Client(logger=True, engineio_logger=True)
+class PlanarAllyFeed:
+    def __init__(self, creature_model, changes):
+        self.creature_model = creature_model
+        self.changes = changes
+        self.creature_indexes = {}
+        self.states = {}
+        self.integrations = []
+        self.updating = False
+
+        self.creature_model.rowsInserted.connect(self.on_rows_inserted)
+        self.creature_model.rowsAboutToBeRemoved.connect(self.on_rows_about_to_be_removed)
+        self.creature_model.modelReset.connect(self.on_model_reset)
+        changes.subscribe(self.on_changeset)
+        self.on_model_reset()
+
+    def subscribe(self, integration):
+        self.integrations.append(integration)
+        integration.on_model_reset()
+
+    def unsubscribe(self, integration):
+        self.integrations.remove(integration)
+        for creature in list(integration.bindings.tokens):
+            self.update_not_found(creature)
+
+    def state(self, creature):
+        state = self.states.get(creature)
+        if state is None:
+            state = self.states[creature] = token_state(creature)
+        return state
+
+    @staticmethod
+    def is_pa_creature(creature):
+        return any(t == "pa" for t, _ in creature.tags)
+
+    def on_changeset(self, changeset):
+        if changeset.reset:
+            for integration in self.integrations:
+                integration.on_model_reset()
+            return
+        changed = [creature for creature, kinds in changeset.changed.values() if kinds & SYNCED_KINDS]
+        for creature in changed:
+            self.states.pop(creature, None)
+        creatures = list(changeset.added.values()) + ([] if self.updating else changed)
+        for integration in self.integrations:
+            if changeset.removed:
+                integration.on_creatures_removed(list(changeset.removed.values()))
+            if creatures:
+                integration.on_creatures_changed(creatures)
+
+    def on_rows_inserted(self, parent, first, last):
+        for i in range(first, last + 1):
+            idx = self.creature_model.index(i, 0)
+            self.creature_indexes[idx.data(QtCore.Qt.UserRole)] = QtCore.QPersistentModelIndex(idx)
+
+    def on_rows_about_to_be_removed(self, parent, first, last):
+        for i in range(first, last + 1):
+            creature = self.creature_model.index(i, 0).data(QtCore.Qt.UserRole)
+            self.creature_indexes.pop(creature, None)
+            self.states.pop(creature, None)
+
+    def on_model_reset(self):
+        self.creature_indexes.clear()
+        self.states.clear()
+        for i in range(self.creature_model.rowCount()):
+            idx = self.creature_model.index(i, 0)
+            self.creature_indexes[idx.data(QtCore.Qt.UserRole)] = QtCore.QPersistentModelIndex(idx)
+
+    def add_creature(self, creature):
+        item = QtGui.QStandardItem()
+        item.setData(creature, QtCore.Qt.UserRole)
+        self.creature_model.appendRow(item)
+
+    def update_not_found(self, creature):
+        if creature not in self.creature_indexes:
+            return
+        not_found = self.is_pa_creature(creature) and not any(creature in i.bindings.tokens for i in self.integrations)
+        tags = [(t, d) for t, d in creature.tags if not t.startswith("pa-")]
+        if not_found:
+            tags.append(("pa-not-found", None))
+        if tags != creature.tags:
+            creature.tags = tags
+            updating, self.updating = self.updating, True
+            self.creature_model.itemFromIndex(QtCore.QModelIndex(self.creature_indexes[creature])).emitDataChanged()
+            self.updating = updating
+
+
+class PlanarAllyIntegration:
+    def __init__(self, url, username, password, room, feed, debounce=0, max_rate=500, cache_dir=CACHE_DIR):
+        self.handlers = {}
+        self.metrics = SyncMetrics()
+        self.cache_dir = cache_dir
+        self.cache_name = re.sub(r"\W+", "_", f"{url}-{username}-{room}")
+        self.name = f"{room} ({url})"
+        self.board_ready = False
         self.tokens = {}
+        self.shadows = {}
+        self.locations = {}
+        self.bindings = BindingIndex(self.cache_name)
         self.auto_add = False
-        self.updating = False
-        self.creature_model = creature_model
-        self.location_id = 1
+        self.feed = feed
+        self.location_id = None
         self.remote_initiative = None
 
-        self.creature_model.dataChanged.connect(self.update_all)
-        self.creature_model.rowsInserted.connect(self.update_all)
-        self.creature_model.rowsRemoved.connect(self.update_all)
-
-        @self.sio.event(namespace="/planarally")
+        self.dirty_creatures = set()
+        self.dirty_tokens = set()
+        self.full_update = True
+        self.update_pending = False
+        self.update_timer = QtCore.QTimer()
+        self.update_timer.setSingleShot(True)
+        self.update_timer.setInterval(debounce)
+        self.update_timer.timeout.connect(self.update_all)
+        self.cache_timer = QtCore.QTimer()
+        self.cache_timer.setInterval(30 * 1000)
+        self.cache_timer.timeout.connect(self.save_cache)
+        self.cache_timer.start()
+
+        self.feed.subscribe(self)
+
+        @self.on("connect")
         def connect():
-            self.sio.emit("Location.Load", namespace="/planarally")
+            logger.info("Connected to %s", url)
+            self.emit("Location.Load")
 
-        @self.sio.on("Location.Set", namespace="/planarally")
-        def message(data):
-            self.location_id = data["id"]
-            self.tokens.clear()
-            self.update_all()
+        def disconnected():
+            logger.warning("Disconnected from %s", url)
+            self.board_ready = False
+            self.save_cache()
 
-        @self.sio.on("Board.Floor.Set", namespace="/planarally")
+        @self.on("Location.Set")
         def message(data):
+            if data["id"] != self.location_id:
+                self.save_cache()
+                if self.location_id is not None:
+                    self.locations[self.location_id] = self.tokens, self.shadows
+                self.bindings.clear_tokens()
+                self.location_id = data["id"]
+                self.remote_initiative = None
+                if self.location_id in self.locations:
+                    self.tokens, self.shadows = self.locations.pop(self.location_id)
+                    for uuid, token in self.tokens.items():
+                        name = self.token_name(token)
+                        if name is not None:
+                            self.bindings.add_token(uuid, name)
+                else:
+                    self.tokens, self.shadows = {}, {}
+                    self.load_cache()
+                self.schedule_update(full=True)
+            self.board_ready = False
+
+        @self.on("Board.Floor.Set")
+        def message(data):
+            floor = data.get("name")
+            seen = set()
             for layer in data["layers"]:
                 if layer["name"] not in ("dm", "tokens"):
                     continue
                 for shape in layer["shapes"]:
-                    self.tokens[shape["uuid"]] = shape
+                    shape.setdefault("floor", floor)
+                    seen.add(shape["uuid"])
+                    old_shadow = self.shadows.get(shape["uuid"])
+                    self.add_token(shape, schedule=False)
+                    if self.shadows[shape["uuid"]] != old_shadow:
+                        self.schedule_update(tokens=[shape["uuid"]])
+
+            for uuid, token in list(self.tokens.items()):
+                if token.floor == floor and uuid not in seen:
+                    self.remove_token(uuid)
 
-            self.update_all()
+            self.board_ready = True
+            self.schedule_update()
 
-        @self.sio.on("Initiative.Set", namespace="/planarally")
+        @self.on("Initiative.Set")
         def message(data):
             if data["location"] == self.location_id:
                 self.remote_initiative = data
+                remote = {d["shape"]: d for d in data["data"]}
+                for uuid, shadow in self.shadows.items():
+                    if uuid not in remote:
+                        shadow.pop("initiative", None)
+                for uuid, d in remote.items():
+                    self.shadows.setdefault(uuid, {})["initiative"] = (d.get("initiative"), d.get("isVisible", False))
 
-        @self.sio.on("Shapes.Remove", namespace="/planarally")
+                self.schedule_update(full=True)
+
+        @self.on("Shapes.Remove")
         def message(data):
             for uuid in data:
-                self.tokens.pop(uuid, None)
+                self.remove_token(uuid)
+
+        @self.on("Shape.Add")
+        def message(data):
+            self.add_token(data)
+
+        @self.on("Shape.Options.Tracker.Update")
+        def message(data):
+            self.shadows.get(data["shape"], {}).pop("tracker", None)
+
+            self.schedule_update(tokens=[data["shape"]])
+
+        @self.on("Shape.Options.Aura.Update")
+        def message(data):
+            self.shadows.get(data["shape"], {}).pop("aura", None)
 
-            self.update_all()
+            self.schedule_update(tokens=[data["shape"]])
 
-        @self.sio.on("Shape.Add", namespace="/planarally")
+        @self.on("Shape.Options.Defeated.Set")
         def message(data):
-            self.tokens[data["uuid"]] = data
+            self.shadows.get(data["shape"], {}).pop("defeated", None)
 
-            self.update_all()
+            self.schedule_update(tokens=[data["shape"]])
 
-        @self.sio.on("Shape.Options.ShowBadge.Set", namespace="/planarally")
+        @self.on("Shape.Options.FillColour.Set")
         def message(data):
-            self.tokens[data["shape"]]["show_badge"] = data["value"]
+            self.shadows.get(data["shape"], {}).pop("fill_colour", None)
 
-            self.update_all()
+            self.schedule_update(tokens=[data["shape"]])
 
-        @self.sio.on("Shape.Options.Name.Set", namespace="/planarally")
+        @self.on("Shape.Options.ShowBadge.Set")
         def message(data):
-            print(self.tokens.keys())
-            self.tokens[data["shape"]]["name"] = data["value"]
+            self.tokens[data["shape"]].show_badge = data["value"]
+            self.rename_token(data["shape"])
 
-            self.update_all()
+        @self.on("Shape.Options.Name.Set")
+        def message(data):
+            self.tokens[data["shape"]].name = data["value"]
+            self.rename_token(data["shape"])
 
-        @self.sio.on("Shapes.Layer.Change", namespace="/planarally")
+        @self.on("Shapes.Layer.Change")
         def message(data):
             for uuid in data["uuids"]:
-                self.tokens[uuid].update({
-                    "layer": data["layer"],
-                    "floor": data["floor"]
-                })
-
-            self.update_all()
-
-        self.sio.connect(
-            f"{url}/socket.io/?user={username}&room={room}",
-            namespaces=["/planarally"],
-            headers={"Cookie": f"AIOHTTP_SESSION={r.cookies['AIOHTTP_SESSION']}"},
-            transports=["websocket"]
-        )
+                token = self.tokens[uuid]
+                token.layer = data["layer"]
+                token.floor = data["floor"]
+
+            self.schedule_update(tokens=data["uuids"])
+
+        self.transport = PlanarAllyTransport(url, username, password, room, [e for e in self.handlers if e != "connect"], max_rate=max_rate)
+        self.transport.connected.connect(self.handlers["connect"], QtCore.Qt.QueuedConnection)
+        self.transport.disconnected.connect(disconnected, QtCore.Qt.QueuedConnection)
+        self.transport.event_received.connect(self.on_event, QtCore.Qt.QueuedConnection)
+        self.transport.start()
+
+    def on(self, event):
+        def decorator(f):
+            self.handlers[event] = f
+            return f
+        return decorator
+
+    def on_event(self, event, data):
+        self.metrics.inbound[event] += 1
+        logger.debug("Received %s", event)
+        with profiler.span("PlanarAllyIntegration.on_event", event=event):
+            self.handlers[event](data)
+
+    def emit(self, event, data=None):
+        self.metrics.outbound[event] += 1
+        self.transport.emit(event, data)
+
+    def stats(self):
+        token_names = collections.Counter(self.bindings.token_names.values())
+        return self.metrics.to_json() | {
+            "tokens": len(self.tokens),
+            "creatures": len(self.feed.creature_indexes),
+            "location": self.location_id,
+            "cached_locations": len(self.locations),
+            "matched": len(self.bindings.creatures),
+            "unbound_tokens": len(self.bindings.unbound_tokens.names),
+            "unbound_creatures": len(self.bindings.unbound_creatures.names),
+            "duplicate_token_names": sum(1 for c in token_names.values() if c > 1),
+            "transport": self.transport.stats()
+        }
 
-    def update_all(self):
-        if self.updating:
+    def token_name(self, token):
+        if token.src == "/static/img/spawn.png":
+            return None
+        name = token.name or ""
+        if token.show_badge:
+            name += str(token.badge + 1)
+        return name
+
+    def rename_token(self, uuid):
+        name = self.token_name(self.tokens[uuid])
+        if name is not None:
+            self.bindings.rename_token(uuid, name)
+        self.schedule_update(tokens=[uuid])
+
+    def add_token(self, shape, schedule=True):
+        token = self.tokens[shape["uuid"]] = Token.from_shape(shape)
+        name = self.token_name(token)
+        if name is not None:
+            self.bindings.add_token(token.uuid, name)
+        if schedule:
+            self.schedule_update(tokens=[token.uuid])
+        shadow = {
+            "defeated": token.is_defeated,
+            "fill_colour": token.fill_colour
+        }
+        for tracker in shape.get("trackers", []):
+            if tracker["name"] == "HP":
+                shadow["tracker"] = (tracker["uuid"], tracker["value"], tracker["maxvalue"], tracker["primary_color"])
+                break
+        for aura in shape.get("auras", []):
+            if aura["name"] == "Vision":
+                shadow["aura"] = (aura["uuid"], aura["active"], aura["value"], aura["dim"], aura["colour"], aura["visible"])
+                break
+        old_shadow = self.shadows.get(token.uuid, {})
+        if "initiative" in old_shadow:
+            shadow["initiative"] = old_shadow["initiative"]
+        self.shadows[token.uuid] = shadow
+
+    def remove_token(self, uuid):
+        self.tokens.pop(uuid, None)
+        self.shadows.pop(uuid, None)
+        creature = self.bindings.remove_token(uuid)
+        self.schedule_update(creatures=[creature] if creature is not None else [], tokens=[uuid])
+
+    def cache_path(self):
+        return self.cache_dir / f"{self.cache_name}-{self.location_id}.json"
+
+    def load_cache(self):
+        try:
+            with open(self.cache_path()) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
             return
+        for token in data["tokens"]:
+            self.add_token(token, schedule=False)
+        for uuid, shadow in data["shadows"].items():
+            self.shadows[uuid] = {k: tuple(v) if isinstance(v, list) else v for k, v in shadow.items()}
 
-        self.updating = True
-        creatures_by_name = {}
-
-        for i in range(self.creature_model.rowCount()):
-            idx = self.creature_model.index(i, 0)
-            creature = idx.data(QtCore.Qt.UserRole)
-            if not any(t == "pa" for t, _ in creature.tags):
-                continue
-            if creature.name.lower() not in creatures_by_name:
-                creatures_by_name[creature.name.lower()] = (creature, idx)
-            else:
-                self.set_creature_tags(creature, idx, duplicate=True)
-
-        tokens_by_name = {}
-        duplicate_token_names = set()
-        initiative = []
-
-        for token in self.tokens.values():
-            if token.get("src") == "/static/img/spawn.png":
-                continue
-            token_name = token.get("name")
-            if token.get("show_badge"):
-                token_name += str(token.get("badge") + 1)
-            if token_name not in tokens_by_name:
-                tokens_by_name[token_name] = token
-            else:
-                duplicate_token_names.add(token_name)
-
-        for token_name, token in sorted(tokens_by_name.items()):
-            print(" -> Found", token_name, creatures_by_name.keys())
-            if token_name.lower() in creatures_by_name:
-                creature, idx = creatures_by_name.pop(token_name.lower())
-            elif self.auto_add:
-                creature = Creature(name=token_name, tags=[("pa", None)])
-
-                item = QtGui.QStandardItem()
-                item.setData(creature, QtCore.Qt.UserRole)
-                self.creature_model.appendRow(item)
-                idx = self.creature_model.index(self.creature_model.rowCount() - 1, 0)
-            else:
-                continue
+    def save_cache(self):
+        if self.location_id is None or not self.tokens:
+            return
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.cache_path(), "w") as f:
+            json.dump({"tokens": [token.to_json() for token in self.tokens.values()], "shadows": self.shadows}, f)
+
+    def index_creature(self, creature):
+        if self.feed.is_pa_creature(creature):
+            if creature in self.bindings.unbound_creatures and self.bindings.unbound_creatures.names[creature] != creature.name.lower():
+                self.bindings.remove_creature(creature)
+            self.bindings.add_creature(creature)
+        else:
+            token = self.bindings.remove_creature(creature)
+            if token is not None:
+                self.schedule_update(tokens=[token])
+
+    def on_creatures_changed(self, creatures):
+        for creature in creatures:
+            self.index_creature(creature)
+        self.schedule_update(creatures=creatures)
+
+    def on_creatures_removed(self, creatures):
+        for creature in creatures:
+            token = self.bindings.remove_creature(creature)
+            if token is not None:
+                self.schedule_update(tokens=[token])
+
+    def on_model_reset(self):
+        self.bindings.clear()
+        for uuid, token in self.tokens.items():
+            name = self.token_name(token)
+            if name is not None:
+                self.bindings.add_token(uuid, name)
+        self.on_creatures_changed(self.feed.creature_indexes)
+        self.schedule_update(full=True)
+
+    def set_debounce(self, msec):
+        self.update_timer.setInterval(msec)
+
+    def schedule_update(self, creatures=(), tokens=(), full=False):
+        self.dirty_creatures.update(creatures)
+        self.dirty_tokens.update(tokens)
+        self.full_update = self.full_update or full
+        if not self.update_pending:
+            self.update_pending = True
+            self.update_timer.start()
 
-            self.update_creature(token, creature, idx, duplicate_token=token_name in duplicate_token_names)
-            initiative.append((token, creature, idx))
+    def update_all(self):
+        self.update_pending = False
+        if self.feed.updating or not self.board_ready:
+            return
 
-        for creature, idx in creatures_by_name.values():
-            self.set_creature_tags(creature, idx, not_found=True)
-        self.update_initiative(initiative)
-        self.updating = False
+        with self.metrics.time_update_all(), profiler.span("PlanarAllyIntegration.update_all", room=self.name):
+            self.sync_dirty()
+
+    def sync_dirty(self):
+        self.feed.updating = True
+        dirty_creatures, self.dirty_creatures = self.dirty_creatures, set()
+        dirty_tokens, self.dirty_tokens = self.dirty_tokens, set()
+        full, self.full_update = self.full_update, False
+        if full:
+            dirty_creatures.update(self.feed.creature_indexes)
+            dirty_tokens.update(self.tokens)
+
+        if self.auto_add:
+            for uuid in sorted(dirty_tokens & self.bindings.unbound_tokens.names.keys(), key=lambda u: self.token_name(self.tokens[u])):
+                self.feed.add_creature(Creature(name=self.token_name(self.tokens[uuid]), tags=[("pa", None)], pa_tokens={self.cache_name: uuid}))
+
+        pairs = {}
+        for creature in dirty_creatures:
+            uuid = self.bindings.tokens.get(creature)
+            if uuid is not None:
+                pairs[uuid] = creature
+            else:
+                self.feed.update_not_found(creature)
+        for uuid in dirty_tokens:
+            creature = self.bindings.creatures.get(uuid)
+            if creature is not None:
+                pairs[uuid] = creature
+
+        self.metrics.pairs_synced.observe(len(pairs))
+        logger.debug("Syncing %d pairs (full=%s)", len(pairs), full)
+        for uuid, creature in pairs.items():
+            self.update_creature(self.tokens[uuid], creature)
+        self.update_initiative(pairs, self.shadows.keys() if full else dirty_tokens)
+        self.feed.updating = False
 
     def close(self):
-        self.sio.disconnect()
+        self.update_timer.stop()
+        self.cache_timer.stop()
+        self.save_cache()
+        self.transport.close()
+        self.feed.unsubscribe(self)
 
     def set_auto_add(self, value):
         self.auto_add = value
-        self.update_all()
+        self.schedule_update(full=True)
 
-    def update_creature(self, token, creature, creature_idx, duplicate_token):
-        self.set_creature_tags(creature, creature_idx, duplicate_token=duplicate_token)
-        tags = {t for t, _ in creature.tags}
+    def update_creature(self, token, creature):
+        self.feed.update_not_found(creature)
+        state = self.feed.state(creature)
+        shadow = self.shadows.setdefault(token.uuid, {})
         self.set_is_token(token)
-        self.set_defeated(token, creature)
-        self.set_side_data(token, tags)
-        for tracker in token["trackers"]:
-            if tracker["name"] == "HP":
-                print("Updating tracker")
-                self.set_hp_on_token(tracker, token, creature, tags)
-                break
+        self.set_defeated(token, state, shadow)
+        self.set_side_data(token, state, shadow)
+        if token.tracker is not None:
+            self.set_hp_on_token(token, state, shadow)
         else:
-            print("Adding tracker")
-            self.add_hp_to_token(token, creature, tags)
+            logger.debug("Adding tracker to %s", token.uuid)
+            self.add_hp_to_token(token, state, shadow)
 
-        for auras in token["auras"]:
-            if auras["name"] == "Vision":
-                print("Updating aura")
-                self.set_vision_on_token(auras, token, creature, tags)
-                break
+        if token.aura is not None:
+            self.set_vision_on_token(token, state, shadow)
         else:
-            print("Adding aura")
-            self.add_vision_to_token(token, creature, tags)
+            logger.debug("Adding aura to %s", token.uuid)
+            self.add_vision_to_token(token, state, shadow)
 
-    def set_defeated(self, token, creature):
-        creature_defeated = any(t in ("unconscious", "defeated", "dead") for t, _ in creature.tags)
-        if creature_defeated != token["is_defeated"]:
-            self.sio.emit(
+    def set_defeated(self, token, state, shadow):
+        if state.defeated != shadow.get("defeated"):
+            self.emit(
                 "Shape.Options.Defeated.Set",
                 {
-                    "shape": token["uuid"],
-                    "value": creature_defeated
-                },
-                namespace="/planarally"
+                    "shape": token.uuid,
+                    "value": state.defeated
+                }
             )
-            token["is_defeated"] = creature_defeated
+            token.is_defeated = shadow["defeated"] = state.defeated
 
     def set_is_token(self, token):
-        if not token["is_token"]:
-            self.sio.emit(
+        if not token.is_token:
+            self.emit(
                 "Shape.Options.Token.Set",
                 {
-                    "shape": token["uuid"],
+                    "shape": token.uuid,
                     "value": True
-                },
-                namespace="/planarally"
+                }
             )
-            token["is_token"] = True
+            token.is_token = True
 
-    def set_side_data(self, token, tags):
-        sides = [i for i in range(10) if f"side-{i+1}" in tags]
-        if not sides:
-            return
-        side = sides[0]
-        color = [
-            "rgb(12, 97, 20)", # dark green
-            "rgb(255, 215, 0)", # yellow
-            "rgb(32, 220, 219)", # cyan
-            "rgb(0, 2, 195)", # dark blue
-            "rgb(143, 0, 195)", # purple
-            "rgb(109, 59, 0)", # brown
-            "rgb(255, 147, 0)", # orange
-            "rgb(255, 255, 255)", # white
-            "rgb(0, 0, 0)", # black
-            "rgb(148, 148, 148)", # grey
-        ]
-        if token["fill_colour"] != color[side]:
-            self.sio.emit(
+    def set_side_data(self, token, state, shadow):
+        if state.fill_colour is not None and shadow.get("fill_colour") != state.fill_colour:
+            self.emit(
                 "Shape.Options.FillColour.Set",
                 {
-                    "shape": token["uuid"],
-                    "value": color[side]
-                },
-                namespace="/planarally"
+                    "shape": token.uuid,
+                    "value": state.fill_colour
+                }
             )
-            token["fill_colour"] = color
-
-    def set_hp_on_token(self, tracker, token, creature, tags):
-        max_hp = creature.max_hp if creature.max_hp is not None else 1
-        hp = creature.hp if creature.hp is not None else 1
-        if creature.max_hp is None:
-            color = "#FF00FF"
-        elif hp == max_hp:
-            color = "#00FFFF"
-        elif hp > max_hp / 2:
-            color = "#00FF00"
-        else:
-            color = "#FFAA00"
-        if "acchp" not in tags:
-            if hp == 0:
-                hp = 0
-            elif hp <= max_hp / 2:
-                hp = 1
-            else:
-                hp = 2
-            max_hp = 2
+            token.fill_colour = shadow["fill_colour"] = state.fill_colour
+
+    def set_hp_on_token(self, token, state, shadow):
+        hp, max_hp, color = state.tracker
+        if shadow.get("tracker") == (token.tracker, *state.tracker):
+            return
+
         data = {
-            "uuid": tracker["uuid"],
+            "uuid": token.tracker,
             "value": hp,
             "maxvalue": max_hp,
             "primary_color": color,
-            "shape": token["uuid"]
+            "shape": token.uuid
         }
 
-        self.sio.emit("Shape.Options.Tracker.Update", data, namespace="/planarally")
+        self.emit("Shape.Options.Tracker.Update", data)
+        shadow["tracker"] = (token.tracker, *state.tracker)
 
-    def add_hp_to_token(self, token, creature, tags):
+    def add_hp_to_token(self, token, state, shadow):
         tid = str(uuid.uuid4())
         data = {
             "uuid": tid,
@@ -267,40 +624,31 @@ class PlanarAllyIntegration:
             "draw": True,
             "primary_color": "#00FF00",
             "secondary_color": "#888888",
-            "shape": token["uuid"]
+            "shape": token.uuid
         }
-        self.sio.emit("Shape.Options.Tracker.Create", data, namespace="/planarally")
-        token["trackers"].append(data)
-        self.set_hp_on_token(data, token, creature, tags)
-
-    def set_vision_on_token(self, aura, token, creature, tags):
-        range_ = None
-        color = "rgba(0,0,0,0)"
-        public = False
-        if "darkvision-0" in tags:
-            range_ = 0, 0
-        elif "darkvision-60" in tags:
-            range_ = 55, 5
-        elif "darkvision-120" in tags:
-            range_ = 115, 5
-        elif "torch" in tags:
-            range_ = 20, 20
-            color = "rgba(255, 186, 0, 0.5)" # orangey
-            public = True
+        self.emit("Shape.Options.Tracker.Create", data)
+        token.tracker = tid
+        shadow["tracker"] = (tid, data["value"], data["maxvalue"], data["primary_color"])
+        self.set_hp_on_token(token, state, shadow)
+
+    def set_vision_on_token(self, token, state, shadow):
+        if shadow.get("aura") == (token.aura, *state.aura):
+            return
 
+        active, value, dim, colour, visible = state.aura
         data = {
-            "uuid": aura["uuid"],
-            "active": range_ is not None,
-            "value": 0 if range_ is None else range_[0],
-            "dim": 0 if range_ is None else range_[1],
-            "colour": color,
-            "visible": public,
-            "shape": token["uuid"]
+            "uuid": token.aura,
+            "active": active,
+            "value": value,
+            "dim": dim,
+            "colour": colour,
+            "visible": visible,
+            "shape": token.uuid
         }
+        self.emit("Shape.Options.Aura.Update", data)
+        shadow["aura"] = (token.aura, *state.aura)
 
-        self.sio.emit("Shape.Options.Aura.Update", data, namespace="/planarally")
-
-    def add_vision_to_token(self, token, creature, tags):
+    def add_vision_to_token(self, token, state, shadow):
         aid = str(uuid.uuid4())
         data = {
             "uuid": aid,
@@ -314,41 +662,35 @@ class PlanarAllyIntegration:
             "border_colour": "rgba(0,0,0,0)",
             "angle": 360,
             "direction": 0,
-            "shape": token["uuid"]
+            "shape": token.uuid
         }
-        self.sio.emit("Shape.Options.Aura.Create", data, namespace="/planarally")
-        token["auras"].append(data)
-        self.set_vision_on_token(data, token, creature, tags)
+        self.emit("Shape.Options.Aura.Create", data)
+        token.aura = aid
+        shadow["aura"] = (aid, data["active"], data["value"], data["dim"], data["colour"], data["visible"])
+        self.set_vision_on_token(token, state, shadow)
 
-    def set_creature_tags(self, creature, idx, not_found=False, duplicate=False, duplicate_token=False):
-        tags = [(t, d) for t, d in creature.tags if not t.startswith("pa-")]
-        if not_found:
-            tags.append(("pa-not-found", None))
-        if duplicate:
-            tags.append(("pa-duplicate", None))
-        if duplicate_token:
-            tags.append(("pa-duplicate-token", None))
-        creature.tags = tags
-        self.creature_model.itemFromIndex(idx).emitDataChanged()
-
-    def update_initiative(self, initiative):
+    def update_initiative(self, pairs, stale_tokens):
         if self.remote_initiative is None:
             return
 
-        initiative_data = []
-        remote_initiative_by_uuid = {d["shape"]: d for d in self.remote_initiative["data"]}
-        for token, creature, idx in initiative:
-            should_show = token["layer"] == "tokens"
-            if token["uuid"] not in remote_initiative_by_uuid:
-                self.sio.emit("Initiative.Add", {"effects": [], "isGroup": False, "isVisible": should_show, "shape": token["uuid"], "initiative": creature.initiative}, namespace="/planarally")
+        for uuid, creature in pairs.items():
+            token = self.tokens[uuid]
+            should_show = token.layer == "tokens"
+            shadow = self.shadows.setdefault(uuid, {})
+            if "initiative" not in shadow:
+                self.emit("Initiative.Add", {"effects": [], "isGroup": False, "isVisible": should_show, "shape": uuid, "initiative": creature.initiative})
             else:
-                remote_initiative = remote_initiative_by_uuid.pop(token["uuid"])
+                value, visible = shadow["initiative"]
 
-                if creature.initiative != remote_initiative.get("initiative"):
-                    self.sio.emit("Initiative.Value.Set", {"shape": token["uuid"], "value": creature.initiative}, namespace="/planarally")
+                if creature.initiative != value:
+                    self.emit("Initiative.Value.Set", {"shape": uuid, "value": creature.initiative})
 
-                if should_show != remote_initiative.get("isVisible", False):
-                    self.sio.emit("Initiative.Option.Update", {"shape": token["uuid"], "option": "isVisible", "value": should_show}, namespace="/planarally")
+                if should_show != visible:
+                    self.emit("Initiative.Option.Update", {"shape": uuid, "option": "isVisible", "value": should_show})
+            shadow["initiative"] = (creature.initiative, should_show)
 
-        for token_id in remote_initiative_by_uuid.keys():
-            self.sio.emit("Initiative.Remove", token_id, namespace="/planarally")
+        for uuid in stale_tokens:
+            shadow = self.shadows.get(uuid, {})
+            if uuid not in self.bindings.creatures and "initiative" in shadow:
+                self.emit("Initiative.Remove", uuid)
+                del shadow["initiative"]
@@ -0,0 +1,292 @@
+import asyncio
+import json
+import logging
+import threading
+
+from aiohttp import web
+from PyQt5 import QtCore
+
+from .common import CONDITIONS
+from .planarally import token_state
+from .profiling import profiler
+
+
+logger = logging.getLogger(__name__)
+
+SHOWN_KINDS = frozenset({"name", "hp", "tags", "initiative", "turn"})
+
+PUBLIC_TAGS = frozenset(CONDITIONS) | {"dead", "defeated", "concentration"}
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>Initiative</title>
+<style>
+body { font-family: sans-serif; background: #222; color: #eee; margin: 0; }
+h1 { font-size: 1.2em; padding: 8px; margin: 0; background: #333; }
+div.row { display: flex; align-items: center; padding: 8px; border-bottom: 1px solid #333; }
+div.row.current { background: #354; }
+div.row.defeated { opacity: 0.4; text-decoration: line-through; }
+span.init { width: 3em; font-weight: bold; }
+span.name { flex: 1; }
+span.tag { font-size: 0.8em; background: #555; border-radius: 4px; padding: 2px 4px; margin-left: 4px; }
+span.hp { width: 5em; height: 0.6em; margin-left: 8px; background: #444; }
+span.hp span { display: block; height: 100%; }
+</style>
+</head>
+<body>
+<h1 id="round">Waiting...</h1>
+<div id="rows"></div>
+<script>
+let state = null;
+function render() {
+    document.getElementById("round").textContent = state.round > 0 ? "Round " + state.round : "Not yet started";
+    const rows = document.getElementById("rows");
+    rows.textContent = "";
+    for (const id of state.order) {
+        const [name, init, hp, max_hp, colour, tags, defeated] = state.rows[id];
+        const row = document.createElement("div");
+        row.className = "row" + (id === state.current ? " current" : "") + (defeated ? " defeated" : "");
+        row.innerHTML = '<span class="init"></span><span class="name"></span><span class="hp"><span></span></span>';
+        row.children[0].textContent = init;
+        row.children[1].textContent = name;
+        for (const [tag, rounds] of tags) {
+            const span = document.createElement("span");
+            span.className = "tag";
+            span.textContent = rounds === null ? tag : tag + " " + rounds;
+            row.children[1].appendChild(span);
+        }
+        row.children[2].firstChild.style.width = (max_hp ? 100 * hp / max_hp : 100) + "%";
+        row.children[2].firstChild.style.background = colour;
+        rows.appendChild(row);
+    }
+}
+function connect() {
+    const ws = new WebSocket((location.protocol === "https:" ? "wss://" : "ws://") + location.host + "/ws");
+    ws.onmessage = event => {
+        const msg = JSON.parse(event.data);
+        if (msg.full) {
+            state = msg;
+        } else if (state === null || msg.v !== state.v + 1) {
+            ws.close();
+            return;
+        } else {
+            state.v = msg.v;
+            Object.assign(state.rows, msg.set || {});
+            for (const id of msg.del || []) delete state.rows[id];
+            for (const key of ["order", "current", "round"]) if (key in msg) state[key] = msg[key];
+        }
+        render();
+    };
+    ws.onclose = () => { state = null; setTimeout(connect, 1000); };
+}
+connect();
+</script>
+</body>
+</html>
+"""
+
+
+def public_tags(creature):
+    return [[name, rounds] for name, rounds in creature.tags if name in PUBLIC_TAGS]
+
+
+def player_row(creature):
+    state = token_state(creature)
+    hp, max_hp, colour = state.tracker
+    return [creature.label, creature.initiative, hp, max_hp, colour, public_tags(creature), state.defeated]
+
+
+def is_public(creature):
+    return creature.initiative is not None and not any(name == "hidden" for name, _ in creature.tags)
+
+
+class PlayerViewServer:
+    def __init__(self, host="0.0.0.0", port=8765):
+        self.host = host
+        self.port = port
+        self.state = {"v": 0, "full": True, "rows": {}, "order": [], "current": None, "round": -1}
+        self.clients = set()
+        self.sent_bytes = 0
+
+        self.app = web.Application()
+        self.app.router.add_get("/", self.index)
+        self.app.router.add_get("/ws", self.websocket)
+
+        self.loop = None
+        self.runner = None
+        self.thread = None
+
+    async def index(self, request):
+        return web.Response(text=PAGE, content_type="text/html")
+
+    async def websocket(self, request):
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+        await ws.send_str(json.dumps(self.state))
+        self.clients.add(ws)
+        try:
+            async for _ in ws:
+                pass
+        finally:
+            self.clients.discard(ws)
+        return ws
+
+    def apply(self, delta):
+        state = self.state
+        state["v"] = delta["v"]
+        state["rows"].update(delta.get("set", {}))
+        for id in delta.get("del", ()):
+            state["rows"].pop(id, None)
+        for key in ("order", "current", "round"):
+            if key in delta:
+                state[key] = delta[key]
+
+    async def send(self, delta):
+        self.apply(delta)
+        message = json.dumps(delta, separators=(",", ":"))
+        for ws in list(self.clients):
+            try:
+                await ws.send_str(message)
+                self.sent_bytes += len(message)
+            except ConnectionError:
+                self.clients.discard(ws)
+
+    def push(self, delta):
+        asyncio.run_coroutine_threadsafe(self.send(delta), self.loop)
+
+    async def serve(self):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        return site._server.sockets[0].getsockname()[1]
+
+    def start(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="player-view", daemon=True)
+        self.thread.start()
+        self.port = asyncio.run_coroutine_threadsafe(self.serve(), self.loop).result()
+        logger.info(f"Serving player view on http://{self.host}:{self.port}/")
+        return self.port
+
+    async def shutdown(self):
+        for ws in list(self.clients):
+            await ws.close()
+        await self.runner.cleanup()
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=5)
+
+
+class PlayerView(QtCore.QObject):
+    def __init__(self, app, server, interval=100):
+        super().__init__(app)
+        self.app = app
+        self.server = server
+        self.rows = {}
+        self.keys = {}
+        self.order = []
+        self.current = None
+        self.round = -1
+        self.version = 0
+        self.dirty = {}
+        self.removed = set()
+        self.turn_dirty = True
+        self.reset = True
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.flush)
+
+        app.changes.subscribe(self.on_changeset)
+        self.timer.start()
+
+    def close(self):
+        self.app.changes.unsubscribe(self.on_changeset)
+        self.timer.stop()
+
+    def schedule(self):
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def on_changeset(self, changeset):
+        self.reset = self.reset or changeset.reset
+        for id in changeset.removed:
+            self.dirty.pop(id, None)
+            self.removed.add(id)
+        for id, creature in changeset.added.items():
+            self.removed.discard(id)
+            self.dirty[id] = creature
+        self.dirty.update((id, creature) for id, (creature, kinds) in changeset.changed.items() if kinds & SHOWN_KINDS)
+        self.turn_dirty = (
+            self.turn_dirty or bool(changeset.added or changeset.removed) or changeset.before != changeset.after
+            or any("turn" in kinds for _, kinds in changeset.changed.values())
+        )
+        self.schedule()
+
+    def flush(self):
+        with profiler.span("PlayerView.flush"):
+            delta = self.delta()
+        if delta is not None:
+            self.server.push(delta)
+
+    def forget(self, id):
+        del self.rows[id]
+        del self.keys[id]
+
+    def delta(self):
+        dirty, self.dirty = self.dirty, {}
+        removed, self.removed = self.removed, set()
+        if self.reset:
+            dirty = {c.id: c for c in self.app.source_creatures}
+            removed = self.rows.keys() - dirty.keys()
+            self.reset = False
+            self.turn_dirty = True
+
+        deleted = [id for id in removed if id in self.rows]
+        for id in deleted:
+            self.forget(id)
+        changed = {}
+        order_dirty = bool(deleted)
+        for id, creature in dirty.items():
+            if is_public(creature):
+                key = -creature.initiative, creature.name
+                if self.keys.get(id) != key:
+                    self.keys[id] = key
+                    order_dirty = True
+                row = player_row(creature)
+                if self.rows.get(id) != row:
+                    changed[id] = self.rows[id] = row
+            elif id in self.rows:
+                self.forget(id)
+                deleted.append(id)
+                order_dirty = True
+
+        delta = {}
+        if changed:
+            delta["set"] = changed
+        if deleted:
+            delta["del"] = deleted
+        if order_dirty:
+            order = sorted(self.keys, key=self.keys.get)
+            if order != self.order:
+                delta["order"] = self.order = order
+        if self.turn_dirty or order_dirty:
+            self.turn_dirty = False
+            current = self.app.current_creature(self.app.source_creatures) if self.app.current_round > 0 else None
+            current = current.id if current is not None and current.id in self.rows else None
+            if current != self.current:
+                delta["current"] = self.current = current
+        if self.app.current_round != self.round:
+            delta["round"] = self.round = self.app.current_round
+        if not delta:
+            return None
+        self.version += 1
+        delta["v"] = self.version
+        return delta
@@ -0,0 +1,103 @@
+import collections
+import functools
+import json
+import os
+import threading
+import time
+
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    __slots__ = ("profiler", "name", "args", "start")
+
+    def __init__(self, profiler, name, args):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, self.start, time.perf_counter(), self.args)
+
+
+class Profiler:
+    def __init__(self, capacity=100000, enabled=False):
+        self.enabled = enabled
+        self.spans = collections.deque(maxlen=capacity)
+        self.threads = {}
+        self.epoch = time.perf_counter()
+
+    def span(self, name, **args):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, args)
+
+    def record(self, name, start, end, args=None):
+        thread = threading.current_thread()
+        self.threads[thread.ident] = thread.name
+        self.spans.append((name, start, end - start, thread.ident, args))
+
+    def clear(self):
+        self.spans.clear()
+        self.threads.clear()
+        self.epoch = time.perf_counter()
+
+    def summary(self, last=2000):
+        stats = {}
+        for name, start, duration, tid, args in reversed(list(self.spans)[-last:]):
+            count, total, max_, latest = stats.get(name, (0, 0, 0, duration))
+            stats[name] = count + 1, total + duration, max(max_, duration), latest
+        return {
+            name: {"count": count, "last_ms": latest * 1000, "mean_ms": total / count * 1000, "max_ms": max_ * 1000}
+            for name, (count, total, max_, latest) in sorted(stats.items(), key=lambda x: -x[1][1])
+        }
+
+    def chrome_trace(self):
+        pid = os.getpid()
+        events = [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+            for tid, name in list(self.threads.items())
+        ]
+        for name, start, duration, tid, args in list(self.spans):
+            events.append({
+                "name": name,
+                "ph": "X",
+                "ts": (start - self.epoch) * 1e6,
+                "dur": duration * 1e6,
+                "pid": pid,
+                "tid": tid,
+                "args": args or {}
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export(self, fname):
+        with open(fname, "w") as f:
+            json.dump(self.chrome_trace(), f)
+
+
+profiler = Profiler(enabled=bool(os.environ.get("BAZOOKA_PROFILE")))
+
+
+def profiled(name):
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return f(*args, **kwargs)
+            with Span(profiler, name, None):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,163 @@
+"""
+Usage:
+    qac.py [-o <file>] [--average-hp] <script>...
+
+Options:
+    -o <file>       Save file to write [default: -]
+    --average-hp    Start in average HP mode (as if the script began with "eha")
+"""
+
+import json
+import random
+import sys
+import time
+
+from .common import Creature, CreatureGroup, DEvalMode, DLexer, DParser, d_eval, load_stat_from_sheet
+
+
+OPS = {"a", "h", "i", "x", "c", "g", "t", "s", "e"}
+
+
+class QACError(RuntimeError):
+    def __init__(self, line, message):
+        super().__init__(message)
+        self.line = line
+        self.message = message
+
+    def __str__(self):
+        return f"Line {self.line}: {self.message}"
+
+
+def parse_tag(tag):
+    if ":" in tag:
+        tag, rounds = tag.split(":", 1)
+        return tag, int(rounds)
+    return tag, None
+
+
+def compile_qac(text):
+    for lineno, line in enumerate(text.splitlines(), 1):
+        for statement in line.split(";"):
+            statement = statement.strip()
+            if not statement:
+                continue
+            op, arg = statement[0], statement[1:].strip()
+            if op not in OPS:
+                raise QACError(lineno, f"Unknown operation {op!r}")
+            yield lineno, op, arg
+
+
+def count_lines(text):
+    return text.count("\n") + 1
+
+
+class QACRunner:
+    def __init__(self, text, hp_de_mode=DEvalMode.normal, batch_size=256, rng=random):
+        self.text = text
+        self.rng = rng
+        self.total_lines = count_lines(text)
+        self.hp_de_mode = hp_de_mode
+        self.batch_size = batch_size
+
+    def run(self, cancelled=lambda: False):
+        hp_de_mode = self.hp_de_mode
+        rng = self.rng
+        current = None
+        batch = []
+        lineno = 0
+
+        def finish(creature):
+            if not creature.max_hp_generator:
+                creature.max_hp_generator = "1"
+            batch.append(creature)
+
+        for lineno, op, arg in compile_qac(self.text):
+            if cancelled():
+                return
+            try:
+                if op == "a":
+                    if current is not None:
+                        finish(current)
+                    current = Creature(name=arg)
+                elif op == "s":
+                    sheet, name = arg.split(":", 1)
+                    data = load_stat_from_sheet(sheet, name)
+                    tags = [parse_tag(tag) for tag in data.get("tags", [])]
+                    init = d_eval(data.get("init"), rng=rng)
+                    hp = data["hp"] if hp_de_mode is DEvalMode.normal else str(d_eval(data["hp"], mode=hp_de_mode, rng=rng))
+                    if current is not None:
+                        finish(current)
+                    current = Creature(name=name, max_hp_generator=hp, xp=data.get("xp"), initiative=init, tags=tags, saves=dict(data.get("saves", {})))
+                elif op == "e":
+                    if arg == "hn":
+                        hp_de_mode = DEvalMode.normal
+                    elif arg == "ha":
+                        hp_de_mode = DEvalMode.average
+                elif current is None:
+                    raise ValueError("No creature to modify, use 'a' or 's' first")
+                elif op == "h":
+                    val = d_eval(arg, mode=hp_de_mode, rng=rng)
+                    current.max_hp_generator = arg if hp_de_mode is DEvalMode.normal else str(val)
+                elif op == "i":
+                    current.initiative = d_eval(arg, rng=rng)
+                elif op == "x":
+                    current.xp = int(arg)
+                elif op == "t":
+                    current.tags.append(parse_tag(arg))
+                elif op == "c":
+                    for _ in range(int(arg)):
+                        finish(current)
+                        current = current.clone()
+                elif op == "g":
+                    current = CreatureGroup.from_template(current, int(arg))
+            except QACError:
+                raise
+            except (DLexer.LexerError, DParser.ParserError) as e:
+                raise QACError(lineno, f"Invalid dice expression in {op + arg!r}") from e
+            except KeyError as e:
+                raise QACError(lineno, f"Not found: {e}") from e
+            except Exception as e:
+                raise QACError(lineno, str(e) or type(e).__name__) from e
+
+            if len(batch) >= self.batch_size:
+                yield lineno, batch
+                batch = []
+
+        if current is not None:
+            finish(current)
+        if batch:
+            yield lineno, batch
+
+
+def build_save(creatures):
+    return {
+        "creatures": [creature.to_json() for creature in creatures],
+        "current_round": -1,
+        "xp_gained": 0,
+        "start_time": time.time()
+    }
+
+
+if __name__ == "__main__":
+    import docopt
+
+    args = docopt.docopt(__doc__)
+
+    hp_de_mode = DEvalMode.average if args["--average-hp"] else DEvalMode.normal
+    creatures = []
+    for script in args["<script>"]:
+        with open(script) as f:
+            runner = QACRunner(f.read(), hp_de_mode=hp_de_mode)
+        try:
+            for _, batch in runner.run():
+                creatures.extend(batch)
+        except QACError as e:
+            sys.exit(f"QAC failed in {script}: {e}")
+
+    data = build_save(creatures)
+
+    if args["-o"] == "-":
+        json.dump(data, sys.stdout, indent=4)
+    else:
+        with open(args["-o"], "w") as f:
+            json.dump(data, f, indent=4)
@@ -0,0 +1,246 @@
+"""
+Usage:
+    saveformat.py convert <input> <output>
+    saveformat.py info <file>
+
+Converts encounter saves between JSON and the binary format, picked by the output extension (.json or .bzk).
+"""
+
+import array
+import json
+import struct
+import sys
+
+
+MAGIC = b"BZKE"
+VERSION = 2
+BINARY_SUFFIX = ".bzk"
+
+NONE = -2 ** 31
+INT_FIELDS = ["initiative", "evaluated_max_hp", "damage_taken", "death_saves_success", "death_saves_failure", "completed_round", "xp"]
+STRING_FIELDS = ["id", "name", "max_hp_generator", "hp_error"]
+JSON_FIELDS = ["saves", "pa_tokens"]
+FIELDS = INT_FIELDS + STRING_FIELDS
+COLUMN_FIELDS = set(FIELDS) | set(JSON_FIELDS) | {"tags"}
+META_FIELDS = ["current_round", "xp_gained", "start_time"]
+
+HEADER = struct.Struct("<4sH")
+SECTION = struct.Struct("<I")
+
+
+def is_binary(data):
+    return data[:len(MAGIC)] == MAGIC
+
+
+def int_array(values):
+    column = array.array("i", values)
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column.tobytes()
+
+
+def read_int_array(data):
+    column = array.array("i")
+    column.frombytes(data)
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column
+
+
+def storable_int(value):
+    return type(value) is int and NONE < value < 2 ** 31
+
+
+def copy_json(value):
+    if isinstance(value, dict):
+        return {key: copy_json(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [copy_json(item) for item in value]
+    return value
+
+
+def dumps(data):
+    creatures = data["creatures"]
+    strings = {}
+    ints = {field: [] for field in INT_FIELDS}
+    string_columns = {field: [] for field in STRING_FIELDS}
+    json_columns = {field: [] for field in JSON_FIELDS}
+    tag_offsets, tag_names, tag_rounds = [0], [], []
+    extra_offsets, extras = [0], []
+
+    def intern(value):
+        index = strings.get(value)
+        if index is None:
+            index = strings[value] = len(strings)
+        return index
+
+    for i, creature in enumerate(creatures):
+        extra = {field: value for field, value in creature.items() if field not in COLUMN_FIELDS}
+        for field in INT_FIELDS:
+            value = creature.get(field)
+            if value is None or storable_int(value):
+                ints[field].append(NONE if value is None else value)
+            else:
+                ints[field].append(NONE)
+                extra[field] = value
+        for field in STRING_FIELDS:
+            value = creature.get(field)
+            if value is None or isinstance(value, str):
+                string_columns[field].append(-1 if value is None else intern(value))
+            else:
+                string_columns[field].append(-1)
+                extra[field] = value
+        for field in JSON_FIELDS:
+            value = creature.get(field)
+            json_columns[field].append(-1 if value is None else intern(json.dumps(value, sort_keys=True)))
+        tags = creature.get("tags", ())
+        if all(isinstance(name, str) and (rounds is None or storable_int(rounds)) for name, rounds in tags):
+            for name, rounds in tags:
+                tag_names.append(intern(name))
+                tag_rounds.append(NONE if rounds is None else rounds)
+        else:
+            extra["tags"] = tags
+        tag_offsets.append(len(tag_names))
+        if extra:
+            extras.append(json.dumps(extra).encode())
+        extra_offsets.append(extra_offsets[-1] + len(extras[-1]) if extra else extra_offsets[-1])
+
+    meta = {field: data.get(field) for field in META_FIELDS} | {"count": len(creatures)}
+    sections = [
+        json.dumps(meta).encode(),
+        json.dumps(list(strings)).encode(),
+        *(int_array(ints[field]) for field in INT_FIELDS),
+        *(int_array(string_columns[field]) for field in STRING_FIELDS),
+        *(int_array(json_columns[field]) for field in JSON_FIELDS),
+        int_array(tag_offsets),
+        int_array(tag_names),
+        int_array(tag_rounds),
+        int_array(extra_offsets),
+        b"".join(extras)
+    ]
+    return HEADER.pack(MAGIC, VERSION) + b"".join(SECTION.pack(len(section)) + section for section in sections)
+
+
+class BinaryCreatures:
+    def __init__(self, encounter):
+        self.encounter = encounter
+
+    def __len__(self):
+        return self.encounter.count
+
+    def __getitem__(self, i):
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.encounter.creature(i)
+
+    def __iter__(self):
+        return iter(self.encounter.decode(range(len(self))))
+
+
+class BinaryEncounter:
+    def __init__(self, data):
+        magic, version = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("Not a binary encounter")
+        if version != VERSION:
+            raise ValueError(f"Unsupported binary encounter version {version}")
+        view = memoryview(data)
+        offset = HEADER.size
+        sections = []
+        while offset < len(data):
+            size, = SECTION.unpack_from(data, offset)
+            offset += SECTION.size
+            sections.append(view[offset:offset + size])
+            offset += size
+        sections = iter(sections)
+
+        self.meta = json.loads(bytes(next(sections)))
+        self.count = self.meta["count"]
+        self.strings = json.loads(bytes(next(sections)))
+        self.ints = {field: read_int_array(next(sections)) for field in INT_FIELDS}
+        self.string_columns = {field: read_int_array(next(sections)) for field in STRING_FIELDS}
+        self.json_columns = {field: read_int_array(next(sections)) for field in JSON_FIELDS}
+        self.tag_offsets = read_int_array(next(sections))
+        self.tag_names = read_int_array(next(sections))
+        self.tag_rounds = read_int_array(next(sections))
+        self.extra_offsets = read_int_array(next(sections))
+        self.extras = next(sections)
+
+    def creature(self, i):
+        return self.decode(range(i, i + 1))[0]
+
+    def decode(self, rows):
+        strings = self.strings + [None]
+        columns = [[None if value == NONE else value for value in self.ints[field][rows.start:rows.stop]] for field in INT_FIELDS]
+        columns += [[strings[index] for index in self.string_columns[field][rows.start:rows.stop]] for field in STRING_FIELDS]
+        parsed = {-1: None}
+        for field in JSON_FIELDS:
+            column = self.json_columns[field][rows.start:rows.stop]
+            for index in set(column) - parsed.keys():
+                parsed[index] = json.loads(strings[index])
+            columns.append([copy_json(parsed[index]) for index in column])
+        tag_offsets = self.tag_offsets
+        first_tag, last_tag = tag_offsets[rows.start], tag_offsets[rows.stop]
+        tags = [
+            (strings[name], None if rounds == NONE else rounds)
+            for name, rounds in zip(self.tag_names[first_tag:last_tag], self.tag_rounds[first_tag:last_tag])
+        ]
+        creatures = []
+        for i, values in zip(rows, zip(*columns)):
+            creature = dict(zip(FIELDS + JSON_FIELDS, values))
+            creature["tags"] = tags[tag_offsets[i] - first_tag:tag_offsets[i + 1] - first_tag]
+            start, end = self.extra_offsets[i], self.extra_offsets[i + 1]
+            if start != end:
+                creature.update(json.loads(bytes(self.extras[start:end])))
+            creatures.append(creature)
+        return creatures
+
+    def get(self, key, default=None):
+        if key == "creatures":
+            return BinaryCreatures(self)
+        value = self.meta.get(key)
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        if key == "creatures":
+            return BinaryCreatures(self)
+        return self.meta[key]
+
+    def to_json(self):
+        return {field: self.meta.get(field) for field in META_FIELDS} | {"creatures": list(self["creatures"])}
+
+
+def loads(data):
+    if is_binary(data):
+        return BinaryEncounter(data)
+    return json.loads(data)
+
+
+def read(fname):
+    with open(fname, "rb") as f:
+        return loads(f.read())
+
+
+def write(fname, data):
+    if str(fname).endswith(BINARY_SUFFIX):
+        with open(fname, "wb") as f:
+            f.write(dumps(data))
+    else:
+        with open(fname, "w") as f:
+            json.dump(data, f, indent=4)
+
+
+if __name__ == "__main__":
+    import docopt
+
+    args = docopt.docopt(__doc__)
+
+    if args["convert"]:
+        data = read(args["<input>"])
+        if isinstance(data, BinaryEncounter):
+            data = data.to_json()
+        write(args["<output>"], data)
+    else:
+        data = read(args["<file>"])
+        kind = "binary" if isinstance(data, BinaryEncounter) else "json"
+        print(f"{args['<file>']}: {kind}, {len(data['creatures'])} creatures, round {data.get('current_round')}, {data.get('xp_gained')} XP")
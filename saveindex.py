@@ -0,0 +1,106 @@
+import collections
+import json
+import logging
+import os
+import pathlib
+import sqlite3
+
+from . import saveformat
+
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = "index.sqlite"
+SAVE_SUFFIXES = (".json", saveformat.BINARY_SUFFIX)
+
+SaveEntry = collections.namedtuple("SaveEntry", "fname mtime size current_round xp_gained start_time creatures sides")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS saves (
+    fname TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    current_round INTEGER,
+    xp_gained INTEGER,
+    start_time REAL,
+    creatures INTEGER NOT NULL,
+    sides TEXT NOT NULL
+)
+"""
+
+
+def side_counts(creatures):
+    sides = collections.Counter()
+    for creature in creatures:
+        for name, _ in creature.get("tags", ()):
+            if name.startswith("side-"):
+                sides[name[5:]] += creature.get("count", 1)
+    return dict(sorted(sides.items()))
+
+
+def summarize(data):
+    creatures = data["creatures"]
+    return {
+        "current_round": data.get("current_round"),
+        "xp_gained": data.get("xp_gained"),
+        "start_time": data.get("start_time"),
+        "creatures": sum(creature.get("count", 1) for creature in creatures),
+        "sides": side_counts(creatures)
+    }
+
+
+class SaveIndex:
+    def __init__(self, directory):
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(self.directory / INDEX_NAME)
+        self.db.execute(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def update(self, fname, data):
+        stat = os.stat(fname)
+        summary = summarize(data)
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO saves VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (pathlib.Path(fname).name, stat.st_mtime, stat.st_size, summary["current_round"], summary["xp_gained"],
+                 summary["start_time"], summary["creatures"], json.dumps(summary["sides"]))
+            )
+
+    def refresh(self):
+        known = {fname: (mtime, size) for fname, mtime, size in self.db.execute("SELECT fname, mtime, size FROM saves")}
+        present = set()
+        for path in self.directory.iterdir():
+            if path.suffix not in SAVE_SUFFIXES or not path.is_file():
+                continue
+            present.add(path.name)
+            stat = path.stat()
+            if known.get(path.name) == (stat.st_mtime, stat.st_size):
+                continue
+            try:
+                self.update(path, saveformat.read(path))
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                logger.warning(f"Could not index {path}: {e}")
+        with self.db:
+            self.db.executemany("DELETE FROM saves WHERE fname = ?", [(fname,) for fname in known.keys() - present])
+
+    def entries(self, pattern=""):
+        pattern = pattern.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        rows = self.db.execute("SELECT * FROM saves WHERE fname LIKE ? ESCAPE '\\' ORDER BY mtime DESC", (f"%{pattern}%",))
+        return [
+            SaveEntry(str(self.directory / fname), mtime, size, current_round, xp_gained, start_time, creatures, json.loads(sides))
+            for fname, mtime, size, current_round, xp_gained, start_time, creatures, sides in rows
+        ]
+
+
+def record_save(fname, data):
+    try:
+        index = SaveIndex(pathlib.Path(fname).parent)
+        try:
+            index.update(fname, data)
+        finally:
+            index.close()
+    except sqlite3.Error as e:
+        logger.warning(f"Could not update the save index for {fname}: {e}")
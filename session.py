@@ -0,0 +1,186 @@
+"""
+Usage:
+    session.py replay <session> [--repeat=<n>]
+    session.py soak <session> [--duration=<minutes>] [--fake-pa=<tokens>] [--json=<file>]
+
+Options:
+    --repeat=<n>            Number of times to replay the session [default: 1]
+    --duration=<minutes>    How long to keep replaying the session [default: 60]
+    --fake-pa=<tokens>      Also sync to a fake PlanarAlly server with this many tokens
+    --json=<file>           Write the per-iteration soak statistics as JSON
+"""
+
+import collections
+import json
+import os
+import pathlib
+import resource
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+
+VERSION = 3
+
+
+class SessionRecorder:
+    def __init__(self, fname):
+        self.file = open(fname, "w")
+        self.start = time.monotonic()
+        self.write({"version": VERSION, "started": time.time()})
+
+    def write(self, data):
+        self.file.write(json.dumps(data, default=lambda o: o.to_json()) + "\n")
+        self.file.flush()
+
+    def snapshot(self, data):
+        self.write({"t": time.monotonic() - self.start, "snapshot": data})
+
+    def record(self, action, seed, args):
+        self.write({"t": time.monotonic() - self.start, "action": action, "seed": seed, "args": args})
+
+    def on_changeset(self, changeset):
+        if changeset.action is not None and changeset.added:
+            self.write({"t": time.monotonic() - self.start, "added": list(changeset.added)})
+
+    def close(self):
+        self.file.close()
+
+
+def load_session(fname):
+    with open(fname) as f:
+        header = json.loads(f.readline())
+        if header.get("version") != VERSION:
+            raise ValueError(f"Unsupported session version {header.get('version')}")
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def rss():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def map_ids(args, ids):
+    args = dict(args)
+    if "ids" in args:
+        args["ids"] = [ids.get(id, id) for id in args["ids"]]
+    if "modifiers" in args:
+        args["modifiers"] = {ids.get(id, id): modifier for id, modifier in args["modifiers"].items()}
+    if "creatures" in args:
+        args["creatures"] = [creature | {"id": ids.get(creature["id"], creature["id"])} if "id" in creature else creature for creature in args["creatures"]]
+    return args
+
+
+def replay(app, events, save_dir, latencies=None):
+    from PyQt5 import QtCore
+
+    app.synchronous = True
+    ids = {}
+    added = collections.deque()
+
+    def on_changeset(changeset):
+        if changeset.action is not None and changeset.added:
+            added.append(list(changeset.added))
+
+    app.changes.subscribe(on_changeset)
+    try:
+        for event in events:
+            if "snapshot" in event:
+                app.do_load(fname=str(save_dir / "replay.json"), data=event["snapshot"])
+                continue
+            if "added" in event:
+                ids.update(zip(event["added"], added.popleft() if added else ()))
+                continue
+            args = map_ids(event["args"], ids)
+            if event["action"] in ("save", "load"):
+                args["fname"] = str(save_dir / "replay.json")
+            start = time.perf_counter()
+            app.perform(event["action"], seed=event["seed"], **args)
+            QtCore.QCoreApplication.processEvents()
+            if latencies is not None:
+                latencies.setdefault(event["action"], []).append((time.perf_counter() - start) * 1000)
+    finally:
+        app.changes.unsubscribe(on_changeset)
+
+
+def reset(app):
+    app.creature_model.clear()
+    app.current_round = -1
+    app.xp_gained = 0
+    app.history.clear()
+
+
+def soak(app, events, duration, save_dir):
+    tracemalloc.start()
+    end = time.monotonic() + duration
+    first = None
+    iterations = []
+    while time.monotonic() < end:
+        reset(app)
+        latencies = {}
+        replay(app, events, save_dir, latencies)
+        means = {action: statistics.mean(ms) for action, ms in latencies.items()}
+        if first is None:
+            first = means, tracemalloc.get_traced_memory()[0]
+        stats = {
+            "iteration": len(iterations) + 1,
+            "rss_bytes": rss(),
+            "traced_bytes": tracemalloc.get_traced_memory()[0],
+            "traced_growth_bytes": tracemalloc.get_traced_memory()[0] - first[1],
+            "creatures": app.creature_model.rowCount(),
+            "latency_ms": means,
+            "latency_drift": {action: ms / first[0][action] if first[0].get(action) else None for action, ms in means.items()}
+        }
+        if app.pa_integrations:
+            stats["pa_tokens"] = sum(len(pa.tokens) + sum(len(t) for t, _ in pa.locations.values()) for pa in app.pa_integrations)
+            stats["pa_shadows"] = sum(len(pa.shadows) for pa in app.pa_integrations)
+            stats["pa_states"] = len(app.pa_feed.states)
+        iterations.append(stats)
+        worst = max(stats["latency_drift"].items(), key=lambda x: x[1] or 0, default=(None, None))
+        print(f"#{stats['iteration']:<4} rss {stats['rss_bytes'] / 1e6:8.1f}MB  traced +{stats['traced_growth_bytes'] / 1e6:7.2f}MB  "
+              f"worst drift {worst[0]} x{worst[1] or 1:.2f}", flush=True)
+    tracemalloc.stop()
+    return iterations
+
+
+if __name__ == "__main__":
+    import docopt
+
+    args = docopt.docopt(__doc__)
+
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from .__main__ import InitApp
+
+    events = load_session(args["<session>"])
+    app = InitApp()
+
+    server = None
+    if args["--fake-pa"]:
+        from .fakeserver import FakePlanarAlly, make_board
+        server = FakePlanarAlly(make_board(int(args["--fake-pa"])))
+        app.start_pa_integration_with_values(f"{server.start()}/game/user/room", "password")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        save_dir = pathlib.Path(tmp)
+        if args["replay"]:
+            for i in range(int(args["--repeat"])):
+                reset(app)
+                latencies = {}
+                start = time.perf_counter()
+                replay(app, events, save_dir, latencies)
+                print(f"Replayed {len(events)} events in {time.perf_counter() - start:.2f}s")
+                for action, ms in sorted(latencies.items()):
+                    print(f"    {action:<20} {len(ms):>6} {statistics.mean(ms):>10.2f}ms {max(ms):>10.2f}ms")
+        else:
+            iterations = soak(app, events, float(args["--duration"]) * 60, save_dir)
+            if args["--json"]:
+                with open(args["--json"], "w") as f:
+                    json.dump(iterations, f, indent=4)
+
+    app.stop_pa_integrations(list(app.pa_integrations))
+    if server is not None:
+        server.stop()
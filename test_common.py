@@ -0,0 +1,54 @@
+import pytest
+
+from bazooka.common import Creature, CreatureGroup, DEvalMode, d_eval, groupable
+
+
+def goblin(i):
+    return Creature(name=f"Goblin{i}", initiative=15, evaluated_max_hp=7, max_hp_generator="2d6", xp=50, saves={"dex": 2})
+
+
+def test_group_same_template():
+    creatures = [goblin(1), goblin(2)]
+    assert groupable(creatures)
+    group = CreatureGroup.from_creatures(creatures)
+    assert (group.name, group.count, group.initiative, group.total_xp) == ("Goblin", 2, 15, 100)
+    assert [m.name for m in group.members()] == ["Goblin1", "Goblin2"]
+
+
+def test_group_mixed_selection_refused():
+    dragon = Creature(name="Dragon", initiative=3, evaluated_max_hp=200, max_hp_generator="20d12", xp=5000)
+    creatures = [goblin(1), dragon]
+    assert not groupable(creatures)
+    with pytest.raises(ValueError):
+        CreatureGroup.from_creatures(creatures)
+
+
+@pytest.mark.parametrize("field, value", [("initiative", 3), ("xp", 100), ("max_hp_generator", "3d6"), ("saves", {"dex": 3})])
+def test_group_refuses_differing_field(field, value):
+    other = goblin(2)
+    setattr(other, field, value)
+    assert not groupable([goblin(1), other])
+
+
+def test_group_regroups_members():
+    group = CreatureGroup.from_creatures([goblin(1), goblin(2)])
+    assert groupable(group.members() + [goblin(3)])
+
+
+@pytest.mark.parametrize("expr, result", [("7/2", 3), ("-3/2", -2), ("(0-7)/2", -4), ("2d1/2", 1)])
+def test_division_floors_in_both_modes(expr, result):
+    assert d_eval(expr) == result
+    assert d_eval(expr, mode=DEvalMode.average) == result
+
+
+def test_clone_does_not_share_saves():
+    original = goblin(1)
+    clone = original.clone()
+    clone.saves["dex"] = 5
+    assert original.saves == {"dex": 2}
+
+
+def test_group_members_materialized_on_creation():
+    group = CreatureGroup.from_json({"name": "Rat", "max_hp_generator": "1d4", "count": 3})
+    assert group.member_max_hp == [None] * 3 and group.member_damage == [0] * 3
+    assert group.max_hp is None and group.hp_rolls_needed() == 3
@@ -0,0 +1,224 @@
+import asyncio
+import collections
+import logging
+import random
+import threading
+
+import aiohttp
+import socketio
+from PyQt5 import QtCore
+
+
+NAMESPACE = "/planarally"
+
+logger = logging.getLogger(__name__)
+
+COALESCED_EVENTS = {
+    "Shape.Options.Defeated.Set",
+    "Shape.Options.FillColour.Set",
+    "Shape.Options.Token.Set",
+    "Initiative.Value.Set"
+}
+
+
+class EmitQueue:
+    def __init__(self):
+        self.slots = collections.deque()
+        self.keys = {}
+        self.shape_keys = {}
+        self.merged = 0
+        self.dropped = 0
+        self.sent = 0
+
+    def __len__(self):
+        return len(self.slots)
+
+    @staticmethod
+    def coalesce_key(event, data):
+        if isinstance(data, str):
+            return data, None
+        if not isinstance(data, dict) or "shape" not in data:
+            return None, None
+        shape = data["shape"]
+        if event in ("Shape.Options.Tracker.Update", "Shape.Options.Aura.Update"):
+            return shape, (event, shape, data["uuid"])
+        if event == "Initiative.Option.Update":
+            return shape, (event, shape, data["option"])
+        if event in COALESCED_EVENTS:
+            return shape, (event, shape)
+        return shape, None
+
+    def put(self, event, data):
+        shape, key = self.coalesce_key(event, data)
+        if key is not None and key in self.keys:
+            self.keys[key][1] = data
+            self.merged += 1
+            return
+        slot = [event, data, shape, key]
+        self.slots.append(slot)
+        if key is not None:
+            self.keys[key] = slot
+            self.shape_keys.setdefault(shape, set()).add(key)
+        elif shape is not None:
+            # Anything queued for the shape before e.g. a create or remove must stay before it
+            for k in self.shape_keys.pop(shape, ()):
+                del self.keys[k]
+
+    def pop(self, n):
+        batch = []
+        while self.slots and len(batch) < n:
+            event, data, shape, key = slot = self.slots.popleft()
+            if key is not None and self.keys.get(key) is slot:
+                del self.keys[key]
+                self.shape_keys[shape].discard(key)
+                if not self.shape_keys[shape]:
+                    del self.shape_keys[shape]
+            batch.append((event, data))
+        return batch
+
+    def stats(self):
+        return {
+            "depth": len(self.slots),
+            "merged": self.merged,
+            "dropped": self.dropped,
+            "sent": self.sent
+        }
+
+
+class PlanarAllyTransport(QtCore.QObject):
+    event_received = QtCore.pyqtSignal(str, object)
+    connected = QtCore.pyqtSignal()
+    disconnected = QtCore.pyqtSignal()
+    reconnecting = QtCore.pyqtSignal(int, float)
+    failed = QtCore.pyqtSignal(str)
+
+    def __init__(self, url, username, password, room, events, parent=None, max_rate=500, flush_interval=0.05, max_backoff=30):
+        super().__init__(parent)
+        self.url = url
+        self.username = username
+        self.password = password
+        self.room = room
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="planarally", daemon=True)
+        self.outbox = EmitQueue()
+        self.outbox_ready = asyncio.Event()
+        self.flush_interval = flush_interval
+        self.batch_size = max(1, int(max_rate * flush_interval))
+        self.sender = None
+        self.online = asyncio.Event()
+        self.closing = False
+        self.max_backoff = max_backoff
+        self.sio = socketio.AsyncClient(reconnection=False)
+
+        async def connect():
+            self.online.set()
+            self.connected.emit()
+
+        async def disconnect(*args):
+            self.online.clear()
+            self.outbox.dropped += len(self.outbox.pop(len(self.outbox)))
+            self.outbox_ready.clear()
+            self.disconnected.emit()
+            if not self.closing:
+                asyncio.ensure_future(self.reconnect())
+
+        self.sio.on("connect", connect, namespace=NAMESPACE)
+        self.sio.on("disconnect", disconnect, namespace=NAMESPACE)
+        for event in events:
+            self.sio.on(event, self.make_handler(event), namespace=NAMESPACE)
+
+    def make_handler(self, event):
+        async def handler(data=None):
+            self.event_received.emit(event, data)
+        return handler
+
+    def start(self):
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self.run(), self.loop)
+
+    def emit(self, event, data=None):
+        self.loop.call_soon_threadsafe(self.enqueue, event, data)
+
+    def enqueue(self, event, data):
+        self.outbox.put(event, data)
+        self.outbox_ready.set()
+
+    def stats(self):
+        return self.outbox.stats()
+
+    def close(self):
+        if not self.thread.is_alive():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop).result(timeout=5)
+        except Exception:
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=5)
+
+    async def login(self):
+        async with aiohttp.ClientSession() as session:
+            async with session.post(f"{self.url}/api/login", json={"username": self.username, "password": self.password}) as r:
+                r.raise_for_status()
+                return r.cookies["AIOHTTP_SESSION"].value
+
+    async def open(self):
+        session = await self.login()
+        await self.sio.connect(
+            f"{self.url}/socket.io/?user={self.username}&room={self.room}",
+            namespaces=[NAMESPACE],
+            headers={"Cookie": f"AIOHTTP_SESSION={session}"},
+            transports=["websocket"]
+        )
+
+    async def run(self):
+        try:
+            await self.open()
+        except Exception as e:
+            self.failed.emit(str(e) or type(e).__name__)
+            return
+        self.sender = asyncio.ensure_future(self.send())
+
+    async def reconnect(self):
+        delay = 1
+        attempt = 0
+        while not self.closing:
+            attempt += 1
+            self.reconnecting.emit(attempt, delay)
+            await asyncio.sleep(delay * random.uniform(0.8, 1.2))
+            try:
+                await self.open()
+                return
+            except Exception as e:
+                logger.warning("Reconnect attempt %d failed: %s", attempt, e)
+            delay = min(delay * 2, self.max_backoff)
+
+    async def send(self):
+        while True:
+            await self.online.wait()
+            await self.outbox_ready.wait()
+            batch = self.outbox.pop(self.batch_size)
+            if not self.outbox:
+                self.outbox_ready.clear()
+            for event, data in batch:
+                try:
+                    if data is None:
+                        await self.sio.emit(event, namespace=NAMESPACE)
+                    else:
+                        await self.sio.emit(event, data, namespace=NAMESPACE)
+                    self.outbox.sent += 1
+                except socketio.exceptions.SocketIOError as e:
+                    self.outbox.dropped += 1
+                    logger.warning("Dropped %s: %s", event, e)
+            await asyncio.sleep(self.flush_interval)
+
+    async def shutdown(self):
+        self.closing = True
+        if self.sender is not None:
+            self.sender.cancel()
+        await self.sio.disconnect()
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)